@@ -1,30 +1,101 @@
 import os
+import sys
+import errno
 import time
 import sqlite3
 import json
 import uuid
+import base64
+import socket
 import logging
-import threading
-from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory
+import http.client
+from datetime import datetime, timedelta
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
-import yt_dlp
 from functools import wraps
+from scheduler import DownloadScheduler, RetryDownload
+from postprocess import PostProcessingPool
+from ytdl import YoutubeDLPool
+from formats import FormatPolicy, FormatPolicyError, format_spec, parse_policy, selected_info
+from retention import RetentionManager, create_usage_schema, usage_stats
+from jobqueue import JobQueue, create_queue_index
+from batches import BatchFormatError, BatchIngestor, parse_entries
+from bandwidth import BandwidthGovernor, create_bandwidth_schema, uses_fragments
+from progress import ProgressStore, ACTIVE_STATES, TERMINAL_STATES
+from db import Database
+from auth import AuthCache, create_user_triggers
+from finalize import finalize_file, same_filesystem
+from diskspace import DiskSpaceGuard, InsufficientSpace, estimate_size
+from dedup import InfoCache, SingleFlight, canonical_video_key, info_video_key
+from library import LibraryIndex
+from metadata import MediaProbe, info_metadata
+from cancel import CancellationRegistry, JobCancelled, terminate_children
+from metrics import Registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from logsetup import RateLimiter, configure_logging, current_download
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='../frontend/build')
 CORS(app)
 
-# Configuration
-DATABASE = '/scripts/downloaderapp/data/video_downloader.db'
+# Configuration; paths can be overridden from the environment (used by the benchmarks)
+DATABASE = os.environ.get('VIDEO_DOWNLOADER_DATABASE', '/scripts/downloaderapp/data/video_downloader.db')
 SECRET_KEY = 'your_secret_key'  # Change this in production
-DOWNLOAD_DIR = '/tmp/downloads'
-TARGET_DIR = '/mnt/VOLUMEPATH'
+DOWNLOAD_DIR = os.environ.get('VIDEO_DOWNLOADER_DOWNLOAD_DIR', '/tmp/downloads')
+TARGET_DIR = os.environ.get('VIDEO_DOWNLOADER_TARGET_DIR', '/mnt/VOLUMEPATH')
+STAGE_ON_TARGET = False  # Download into TARGET_DIR/.staging so finalizing is a rename
+STAGING_DIR = os.path.join(TARGET_DIR, '.staging') if STAGE_ON_TARGET else DOWNLOAD_DIR
+FINALIZE_CHECKSUM = True  # SHA-256 files while copying across filesystems
+DEFAULT_FORMAT_POLICY = {'videoCodecs': ['avc1'], 'audioCodecs': ['mp4a']}  # Format policy fields users and requests leave unset
+INFO_CACHE_TTL = 300  # Seconds extracted video info is reused between jobs
+PROBE_WORKERS = 2  # Concurrent ffprobe processes when yt-dlp lacks media info
+POSTPROCESS_WORKERS = os.cpu_count() or 2  # Threads merging, probing and finalizing downloaded videos
+YTDL_POOL_SIZE = 6  # Idle yt-dlp clients a worker process keeps built for new jobs
+MAX_DOWNLOAD_ATTEMPTS = 5  # Tries before a download failing on network errors is marked failed
+RETRY_BACKOFF = 10  # Seconds before the first retry, doubled on every attempt
+RETRY_BACKOFF_MAX = 600  # Longest wait between retries
+DISK_HIGH_WATERMARK = 0.90  # Volume usage above which downloads wait for space and stale temp dirs are pruned
+DISK_LOW_WATERMARK = 0.80  # Usage that pruning stale temp dirs brings the temp volume back down to
+DISK_RETRY_INTERVAL = 30  # Seconds a download waiting for disk space stays queued before checking again
+DISK_CHECK_INTERVAL = 60  # Seconds between checks of the temp volume against the high watermark
+STALE_TEMP_AGE = 3600  # Seconds without writes after which an unclaimed download's temp dir may be pruned
+MAX_CONCURRENT_DOWNLOADS = 4  # Size of the download worker pool
+MAX_DOWNLOADS_PER_USER = 2  # Running downloads allowed per user
+LEASE_TTL = 30  # Seconds a worker's claim on a download lasts without renewal
+QUEUE_POLL_INTERVAL = 1.0  # Seconds between a worker's checks for new or cancelled downloads
+MAX_PRIORITY = 10  # Highest priority an admin can assign to a download
+MAX_BATCH_ENTRIES = 10000  # URLs accepted in one bulk upload
+MAX_BATCH_JOBS = 50000  # Downloads one bulk upload can expand into through playlists and channels
+BATCH_INSERT_SIZE = 500  # Expanded jobs inserted per transaction
+BANDWIDTH_LIMIT = 0  # Total download rate in bytes/sec shared by all users, 0 for unlimited
+FRAGMENT_CONCURRENCY = 1  # Fragments fetched in parallel per HLS/DASH download
+MAX_FRAGMENT_CONCURRENCY = 16  # Highest fragment concurrency an admin can set
+PROGRESS_FLUSH_INTERVAL = 1.0  # Seconds between batched progress writes
+DB_POOL_SIZE = 8  # Idle SQLite connections kept open for reuse
+STREAM_MIN_INTERVAL = 0.25  # Seconds between progress events sent to one client
+STREAM_KEEPALIVE = 15  # Seconds between keep-alive comments on an idle stream
+STREAM_DB_INTERVAL = 1.0  # Seconds between database reads of watched downloads the progress store does not hold
+MAX_STATUS_IDS = 100  # Downloads accepted by one batch status request
+HISTORY_RETENTION_DAYS = 90  # Finished downloads older than this move to downloads_archive, 0 to keep them all
+RETENTION_INTERVAL = 3600  # Seconds between archive runs
+RETENTION_BATCH_SIZE = 1000  # Rows moved to the archive per transaction
+ANALYZE_INTERVAL = 86400  # Seconds between ANALYZE runs
+VACUUM_INTERVAL = 7 * 86400  # Shortest time between VACUUMs, which only run when a fifth of the file is free pages
+DEFAULT_STATS_DAYS = 30  # Days covered by /api/stats when no range is given
+DEFAULT_PAGE_SIZE = 50  # History rows returned when no limit is given
+MAX_PAGE_SIZE = 200  # Largest history page a client can request
+AUTH_CACHE_TTL = 60  # Seconds verified tokens and user privileges are served from memory
+AUTH_CHECK_INTERVAL = 1.0  # Seconds between checks for users changed by other processes
+WORKER_METRICS_PORT = 9400  # First port serving /metrics in worker processes, 0 to disable
+WORKER_METRICS_PORTS = 16  # Ports tried from WORKER_METRICS_PORT on, so several workers can share a host
+LOG_LEVEL = logging.INFO
+LOG_FORMAT = 'json'  # 'json' for one object per line, 'text' for plain lines
+PROGRESS_LOG_INTERVAL = 10  # Seconds between progress log lines for one download
+
+# Set up logging; records are written by a background thread
+configure_logging(LOG_LEVEL, LOG_FORMAT == 'json')
 
 # Create directories with error handling
 try:
@@ -33,6 +104,13 @@ try:
 except Exception as e:
     logger.error(f"Error creating download directory: {str(e)}")
 
+if STAGE_ON_TARGET:
+    try:
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        logger.info(f"Staging directory created/verified: {STAGING_DIR}")
+    except Exception as e:
+        logger.error(f"Error creating staging directory: {str(e)}")
+
 try:
     os.makedirs(TARGET_DIR, exist_ok=True)
     logger.info(f"Target directory created/verified: {TARGET_DIR}")
@@ -51,33 +129,144 @@ except Exception as e:
     except Exception as perm_error:
         logger.error(f"Failed to fix permissions on: {TARGET_DIR} - {str(perm_error)}")
 
+# Prometheus metrics for the download pipeline, served on /metrics
+metrics = Registry()
+stage_seconds = metrics.histogram('ytdl_stage_duration_seconds', 'Time spent in each download pipeline stage',
+                                  ['stage'])
+db_write_seconds = metrics.histogram('ytdl_db_write_seconds', 'Latency of database write transactions',
+                                     buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+downloads_finished = metrics.counter('ytdl_downloads_finished_total', 'Downloads that reached a final state',
+                                     ['status'])
+download_failures = metrics.counter('ytdl_download_failures_total', 'Failed download attempts by exception type',
+                                    ['exception'])
+disk_space_waits = metrics.counter('ytdl_disk_space_waits_total', 'Download attempts held back for lack of disk space')
+downloaded_bytes = metrics.counter('ytdl_downloaded_bytes_total', 'Size of the files yt-dlp finished downloading')
+transfer_speed = metrics.gauge('ytdl_transfer_bytes_per_second', 'Current speed of each running transfer',
+                               ['download_id'])
+metrics.gauge('ytdl_transfer_bytes_per_second_total', 'Combined speed of all running transfers',
+              func=lambda: sum(transfer_speed.values().values()))
+
+# Shared pooled connections to the SQLite database
+db = Database(DATABASE, DB_POOL_SIZE, write_histogram=db_write_seconds)
+
 # Initialize database
 def init_db():
     logger.info("Initializing database")
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        is_admin BOOLEAN NOT NULL DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Check if aspect_ratio column exists in downloads table
-    cursor.execute("PRAGMA table_info(downloads)")
-    columns = cursor.fetchall()
-    column_names = [column[1] for column in columns]
-    
-    # Create or alter downloads table
-    if 'downloads' not in [table[0] for table in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]:
-        # Create downloads table with aspect_ratio column
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        # Serialize schema setup between processes starting together
+        cursor.execute("BEGIN IMMEDIATE")
+        
+        # Users table
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS downloads (
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            is_admin BOOLEAN NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # Default format policy of each user, added after the users table
+        cursor.execute("PRAGMA table_info(users)")
+        if 'format_policy' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE users ADD COLUMN format_policy TEXT')
+        
+        # Check if aspect_ratio column exists in downloads table
+        cursor.execute("PRAGMA table_info(downloads)")
+        columns = cursor.fetchall()
+        column_names = [column[1] for column in columns]
+        
+        # Create or alter downloads table
+        if 'downloads' not in [table[0] for table in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]:
+            # Create downloads table with aspect_ratio column
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS downloads (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                target_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL DEFAULT 0,
+                aspect_ratio TEXT DEFAULT 'Unknown',
+                resolution TEXT,
+                duration REAL,
+                vcodec TEXT,
+                acodec TEXT,
+                bitrate REAL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                batch_id TEXT,
+                file_size INTEGER,
+                format_policy TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''')
+        else:
+            # Add columns missing from an existing downloads table
+            for column_name, column_def in [
+                ('aspect_ratio', 'TEXT DEFAULT "Unknown"'),
+                ('priority', 'INTEGER NOT NULL DEFAULT 0'),
+                ('resolution', 'TEXT'),
+                ('duration', 'REAL'),
+                ('vcodec', 'TEXT'),
+                ('acodec', 'TEXT'),
+                ('bitrate', 'REAL'),
+                ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+                ('lease_owner', 'TEXT'),
+                ('lease_expires', 'REAL'),
+                ('batch_id', 'TEXT'),
+                ('file_size', 'INTEGER'),
+                ('format_policy', 'TEXT'),
+            ]:
+                if column_name not in column_names:
+                    cursor.execute(f'ALTER TABLE downloads ADD COLUMN {column_name} {column_def}')
+                    logger.info(f"Added {column_name} column to downloads table")
+        
+        # Finished files by video and format, for serving repeat requests from disk
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS library (
+            video_key TEXT NOT NULL,
+            format_key TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            checksum TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (video_key, format_key)
+        )
+        ''')
+        
+        # Bulk uploads; entries are expanded into downloads in the background,
+        # next_entry/entry_offset record how far expansion got
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batches (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            entries TEXT NOT NULL,
+            next_entry INTEGER NOT NULL DEFAULT 0,
+            entry_offset INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            failed_entries INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            lease_owner TEXT,
+            lease_expires REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''')
+        
+        # Finished downloads moved out of the downloads table by the retention job
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS downloads_archive (
             id TEXT PRIMARY KEY,
             user_id INTEGER NOT NULL,
             url TEXT NOT NULL,
@@ -85,36 +274,86 @@ def init_db():
             status TEXT NOT NULL,
             progress REAL DEFAULT 0,
             aspect_ratio TEXT DEFAULT 'Unknown',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
+            resolution TEXT,
+            duration REAL,
+            vcodec TEXT,
+            acodec TEXT,
+            bitrate REAL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            batch_id TEXT,
+            file_size INTEGER,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_archive_user_created "
+                       "ON downloads_archive (user_id, created_at)")
+        
+        # Per-user, per-day usage totals kept current by triggers on downloads
+        create_usage_schema(cursor)
+        
+        # Last run of periodic database maintenance, shared by all processes
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance (
+            task TEXT PRIMARY KEY,
+            last_run REAL NOT NULL
+        )
+        ''')
+        
+        # Settings changed at runtime and shared by all processes
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
         )
         ''')
-    elif 'aspect_ratio' not in column_names:
-        # Add aspect_ratio column to existing downloads table
-        cursor.execute('ALTER TABLE downloads ADD COLUMN aspect_ratio TEXT DEFAULT "Unknown"')
-        logger.info("Added aspect_ratio column to downloads table")
-    
-    # Create admin user if not exists
-    cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-    if not cursor.fetchone():
-        admin_password = generate_password_hash('admin123')  # Change this default password
-        cursor.execute("INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
-                      ('admin', admin_password, True))
-        logger.info("Admin user created")
-    
-    conn.commit()
-    conn.close()
+        create_user_triggers(cursor)
+        create_bandwidth_schema(cursor)
+        
+        # Indexes backing the keyset-paginated history queries
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_created ON downloads (created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_user_created ON downloads (user_id, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_status_created ON downloads (status, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_batch ON downloads (batch_id, status)")
+        create_queue_index(cursor)
+        
+        # Create admin user if not exists
+        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
+        if not cursor.fetchone():
+            admin_password = generate_password_hash('admin123')  # Change this default password
+            cursor.execute("INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
+                          ('admin', admin_password, True))
+            logger.info("Admin user created")
+    
     logger.info("Database initialization complete")
 
-# Active downloads tracking
-active_downloads = {}
+# Live download progress, flushed to the database in batches
+progress_store = ProgressStore(db, PROGRESS_FLUSH_INTERVAL)
+
+# Hand a queued download to the scheduler and start tracking its progress
+def enqueue_download(download_id, user_id, url, target_path, priority=0):
+    progress_store.register(download_id, user_id)
+    scheduler.submit(download_id, user_id, url, target_path, priority)
+
+# Stop a download this process holds: drop it if queued for a download worker,
+# otherwise signal the job wherever it is running
+def stop_local_download(download_id):
+    progress_store.discard(download_id)
+    running = scheduler.cancel(download_id) == 'running' or download_id in postprocessing.jobs
+    if running and not cancellations.is_cancelled(download_id):
+        cancellations.cancel(download_id)
+
+# Verified tokens and user records, so auth checks skip the database
+auth_cache = AuthCache(db, SECRET_KEY, AUTH_CACHE_TTL, check_interval=AUTH_CHECK_INTERVAL)
 
 # Token required decorator
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
+        # EventSource cannot set headers, so streams pass the token in the query string
+        token = request.headers.get('Authorization') or request.args.get('token')
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
@@ -122,13 +361,12 @@ def token_required(f):
         if token.startswith('Bearer '):
             token = token[7:]
         
-        try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            current_user_id = data['user_id']
-        except:
+        # Tokens of deleted users are rejected as well
+        user = auth_cache.authenticate(token)
+        if not user:
             return jsonify({'message': 'Token is invalid!'}), 401
             
-        return f(current_user_id, *args, **kwargs)
+        return f(user['id'], *args, **kwargs)
     
     return decorated
 
@@ -136,21 +374,94 @@ def token_required(f):
 def admin_required(f):
     @wraps(f)
     def decorated(current_user_id, *args, **kwargs):
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT is_admin FROM users WHERE id = ?", (current_user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        user = auth_cache.user(current_user_id)
         
-        if not user or not user[0]:
+        if not user or not user['is_admin']:
             return jsonify({'message': 'Admin privileges required!'}), 403
             
         return f(current_user_id, *args, **kwargs)
     
     return decorated
 
-# Progress hook for yt-dlp
-def progress_hook(d, download_id):
+# Extractor results and in-flight downloads shared between jobs for the same video
+info_cache = InfoCache(INFO_CACHE_TTL)
+download_flights = SingleFlight()
+
+# yt-dlp clients reused between jobs; yt-dlp itself is only imported when the first is built
+ytdl_pool = YoutubeDLPool({
+    'merge_output_format': 'mp4',
+    'outtmpl': '%(title)s.%(ext)s',
+    # Small fixed read blocks keep hooks (and cancellation checks) frequent on slow links
+    'buffersize': 256 * 1024,
+    'noresizebuffer': True,
+    # Send yt-dlp's output through logging instead of printing progress bars
+    'logger': logging.getLogger('yt_dlp'),
+    'noprogress': True,
+}, YTDL_POOL_SIZE)
+metrics.gauge('ytdl_clients_idle', 'yt-dlp clients built and waiting for a job', func=lambda: ytdl_pool.idle)
+metrics.gauge('ytdl_clients_built', 'yt-dlp clients built since the process started', func=lambda: ytdl_pool.built)
+
+# Cancellation flags checked by running downloads
+cancellations = CancellationRegistry()
+
+# Index of videos already stored under TARGET_DIR
+library = LibraryIndex(db, TARGET_DIR)
+
+# ffprobe fallback for media metadata yt-dlp did not report
+media_probe = MediaProbe(PROBE_WORKERS)
+
+# Shares the download rate limit between users' running transfers, and between
+# the worker processes through the database
+bandwidth = BandwidthGovernor(BANDWIDTH_LIMIT, FRAGMENT_CONCURRENCY, db)
+
+# A temp dir can be pruned once no local job or shared download uses it and its download
+# has finished, or has not been written to for STALE_TEMP_AGE seconds
+def is_stale_temp_dir(download_id, idle):
+    if download_id in active_downloads or os.path.join(STAGING_DIR, download_id) in download_flights.temp_dirs():
+        return False
+    row = db.query("SELECT status FROM downloads WHERE id = ?", (download_id,), one=True)
+    return row is None or row['status'] not in ACTIVE_STATES or idle > STALE_TEMP_AGE
+
+# Holds downloads until the temp and target volumes have room for them
+disk_space = DiskSpaceGuard(STAGING_DIR, is_stale_temp_dir, DISK_HIGH_WATERMARK, DISK_LOW_WATERMARK, DISK_CHECK_INTERVAL)
+
+# Space a job needs on each volume: the download in temp_dir, twice over while ffmpeg
+# merges separate streams, and a copy on TARGET_DIR unless the file can be renamed
+# or linked there from source_dir. Sizes come from yt-dlp's info, or the library entry.
+def space_needs(info, source_dir, temp_dir=None, size=None):
+    if size is None:
+        size = (estimate_size(info) if info else None) or 0
+    needs = []
+    if temp_dir is not None:
+        merging = len(info.get('requested_formats') or ()) > 1
+        needs.append((STAGING_DIR, size * 2 if merging else size, temp_dir))
+    if not same_filesystem(source_dir, TARGET_DIR):
+        needs.append((TARGET_DIR, size, None))
+    return needs
+
+# Jobs sharing a download that have not been cancelled
+def active_participants(flight):
+    return [download_id for download_id in flight.participants if not cancellations.is_cancelled(download_id)]
+
+# Abort a shared download once every job waiting on it has been cancelled
+def check_flight_cancelled(flight):
+    if not active_participants(flight):
+        raise JobCancelled()
+
+# Stop an ffmpeg merge that no remaining job needs
+def abort_flight(flight):
+    if not active_participants(flight):
+        terminate_children(flight.temp_dir)
+
+# Limits progress log lines to one per download every PROGRESS_LOG_INTERVAL seconds
+progress_log = RateLimiter(PROGRESS_LOG_INTERVAL)
+
+# Progress hook for yt-dlp; progress is mirrored to every job sharing the download
+def progress_hook(d, flight):
+    participants = active_participants(flight)
+    if not participants:
+        raise JobCancelled()
+    
     if d['status'] == 'downloading':
         if 'total_bytes' in d and d['total_bytes'] > 0:
             progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
@@ -159,132 +470,368 @@ def progress_hook(d, download_id):
         else:
             progress = -1  # Indeterminate
             
-        update_download_status(download_id, 'downloading', progress)
+        for download_id in participants:
+            update_download_status(download_id, 'downloading', progress)
+        transfer_speed.set(d.get('speed') or 0, download_id=flight.leader)
+        if progress_log.allow(flight.leader):
+            logger.info("Progress %.1f%% at %s B/s", progress, d.get('speed'))
     elif d['status'] == 'finished':
-        update_download_status(download_id, 'processing', 100)
+        downloaded_bytes.inc(d.get('total_bytes') or d.get('downloaded_bytes') or 0)
+        for download_id in participants:
+            update_download_status(download_id, 'processing', 100)
+
+# Postprocessor hook for yt-dlp; times the ffmpeg merge of separate video and audio
+def postprocessor_hook(d, flight, timings):
+    check_flight_cancelled(flight)
+    if d.get('postprocessor') != 'Merger':
+        return
+    if d['status'] == 'started':
+        timings['merge_started'] = time.perf_counter()
+    elif d['status'] == 'finished' and 'merge_started' in timings:
+        stage_seconds.observe(time.perf_counter() - timings['merge_started'], stage='merge')
+
+# Update download status; terminal states are written to the database immediately,
+# together with any extra column values in fields
+def update_download_status(download_id, status, progress=0, **fields):
+    if status in TERMINAL_STATES:
+        logger.info("Updating status for %s: %s (%s%%)", download_id, status, progress)
+        downloads_finished.inc(status=status)
+    progress_store.update(download_id, status, progress, fields)
+
+# Extract video info without downloading, for the shared info cache
+def extract_video_info(url):
+    with stage_seconds.time(stage='extract_info'), ytdl_pool.client() as ydl:
+        return ydl.extract_info(url, download=False)
+
+# Yield the video URLs behind a URL: the entries of a playlist or channel, read
+# page by page as they are consumed, or the URL itself for a single video
+def expand_playlist(url):
+    if canonical_video_key(url).startswith('Youtube:') and 'list=' not in url:
+        yield url
+        return
+    
+    # Unprocessed entries are a generator that fetches further pages through ydl
+    with ytdl_pool.client(extract_flat='in_playlist') as ydl:
+        with stage_seconds.time(stage='expand'):
+            info = ydl.extract_info(url, download=False, process=False)
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            yield url
+            return
+        for entry in info.get('entries') or ():
+            entry_url = entry and (entry.get('url') or entry.get('webpage_url'))
+            if entry_url:
+                yield entry_url
 
-# Update download status in the database
-def update_download_status(download_id, status, progress=0):
-    logger.info(f"Updating status for {download_id}: {status} ({progress}%)")
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE downloads SET status = ?, progress = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-        (status, progress, download_id)
+# Download the streams of a video in the formats of spec from its extracted info into
+# temp_dir; returns the pooled client holding the post-processing that turns them into
+# the final file, which goes back to the pool when the job is released
+def fetch_video(info, spec, temp_dir, flight):
+    # Create temp directory
+    os.makedirs(temp_dir, exist_ok=True)
+    logger.debug("TEMP DIR CREATED: %s", temp_dir)
+    
+    # Take a client with this job's hooks and formats, saving into temp_dir
+    timings = {}
+    ydl = ytdl_pool.acquire(
+        format=spec,
+        progress_hooks=[lambda d: progress_hook(d, flight)],
+        postprocessor_hooks=[lambda d: postprocessor_hook(d, flight, timings)],
+        paths={'home': temp_dir},
     )
-    conn.commit()
-    conn.close()
+    
+    # Download the video
+    try:
+        logger.debug("DOWNLOAD STARTED WITH YT-DLP")
+        # The transfer counts against the bandwidth share of the user who started it
+        bandwidth.attach(flight.leader, active_downloads[flight.leader]['user_id'], ydl.params,
+                         uses_fragments(info))
+        started = time.perf_counter()
+        try:
+            ydl.process_ie_result(info, download=True)
+        finally:
+            bandwidth.detach(flight.leader)
+            transfer_speed.remove(download_id=flight.leader)
+            progress_log.forget(flight.leader)
+        stage_seconds.observe(time.perf_counter() - started, stage='download')
+        
+        if ydl.deferred_post_process is None:
+            raise FileNotFoundError(f"yt-dlp did not download {info.get('webpage_url') or info.get('url')}")
+    except BaseException:
+        ytdl_pool.release(ydl)
+        raise
+    logger.info("DOWNLOAD COMPLETED: %s", ydl.deferred_post_process[0])
+    return ydl
+
+# Run the post-processing fetch_video left pending (the merge, if the video was
+# downloaded as separate streams) and return the path of the finished file
+def merge_video(ydl, temp_dir):
+    info = ydl.run_post_process()
+    filename = info.get('filepath') or ydl.prepare_filename(info)
+    
+    # Check if file exists
+    if not os.path.exists(filename):
+        # Try with mp4 extension
+        mp4_filename = f"{filename.rsplit('.', 1)[0]}.mp4"
+        if os.path.exists(mp4_filename):
+            filename = mp4_filename
+            logger.debug("USING MP4 FILENAME: %s", filename)
+    
+    # Verify file exists
+    if not os.path.exists(filename):
+        logger.error("ERROR: FILE NOT FOUND AT %s", filename)
+        files = os.listdir(temp_dir)
+        logger.error("FILES IN TEMP DIR: %s", files)
+        raise FileNotFoundError(f"Downloaded file not found at {filename}")
+    
+    return filename
+
+# Whether a download error is a transient network problem worth retrying
+def is_retryable_error(error):
+    from yt_dlp.networking.exceptions import HTTPError, TransportError
+    from yt_dlp.utils import ContentTooShortError
+    
+    for error in error_chain(error):
+        if isinstance(error, HTTPError):
+            return error.status == 429 or error.status >= 500
+        if isinstance(error, (TransportError, ConnectionError, TimeoutError, socket.timeout,
+                              http.client.IncompleteRead, ContentTooShortError)):
+            return True
+    return False
+
+# Whether a download stopped for lack of disk space, so it should wait for space rather than fail
+def is_out_of_space(error):
+    return any(isinstance(error, InsufficientSpace) or (isinstance(error, OSError) and error.errno == errno.ENOSPC)
+               for error in error_chain(error))
+
+# An exception followed by the exceptions that caused it
+def error_chain(error):
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        # yt-dlp wraps the underlying exception in exc_info
+        exc_info = getattr(error, 'exc_info', None)
+        error = (exc_info[1] if exc_info else None) or error.__cause__ or error.__context__
+
+# Name of the exception behind a failure, for the failure metrics
+def failure_type(error):
+    # yt-dlp wraps the underlying exception in exc_info
+    exc_info = getattr(error, 'exc_info', None)
+    return type((exc_info[1] if exc_info else None) or error).__name__
+
+# Count a failed attempt; return the backoff before retrying, or None once attempts run out
+def schedule_retry(download_id):
+    with db.transaction() as conn:
+        conn.execute("UPDATE downloads SET attempts = attempts + 1 WHERE id = ?", (download_id,))
+        attempts = conn.execute("SELECT attempts FROM downloads WHERE id = ?", (download_id,)).fetchone()[0]
+    
+    if attempts >= MAX_DOWNLOAD_ATTEMPTS:
+        return None
+    return min(RETRY_BACKOFF * 2 ** (attempts - 1), RETRY_BACKOFF_MAX)
+
+# Record the outcome of a job that raised; returns (delay, reason) if it should run again later
+def handle_job_error(download_id, e):
+    if cancellations.is_cancelled(download_id):
+        # The cancel endpoint has already recorded the final status; drop any live
+        # row a hook wrote after it
+        progress_store.discard(download_id)
+        logger.info("DOWNLOAD CANCELLED")
+        downloads_finished.inc(status='cancelled')
+        return None
+    
+    if is_out_of_space(e):
+        # Hold the job in the queue, without counting an attempt, until space frees up
+        disk_space_waits.inc()
+        logger.warning("WAITING FOR DISK SPACE, CHECKING AGAIN IN %ss: %s", DISK_RETRY_INTERVAL, e)
+        update_download_status(download_id, 'queued', 0)
+        return DISK_RETRY_INTERVAL, 'disk_space'
+    
+    download_failures.inc(exception=failure_type(e))
+    if is_retryable_error(e) and (retry_delay := schedule_retry(download_id)) is not None:
+        logger.warning("NETWORK ERROR, RETRYING IN %ss: %s", retry_delay, e)
+        update_download_status(download_id, 'queued', 0)
+        return retry_delay, 'retry'
+    
+    logger.exception("ERROR IN DOWNLOAD: %s", e)
+    update_download_status(download_id, 'failed', 0)
+    return None
 
-# Download function to run in a separate thread
+# Release what a job holds once it stops running. The temp directory is removed once
+# no other job needs the shared download, and kept when the job will run again so
+# yt-dlp can resume the partial file.
+def release_job(job, retrying):
+    disk_space.release(job['id'])
+    if job['ydl'] is not None:
+        ytdl_pool.release(job['ydl'])
+        job['ydl'] = None
+    
+    # Leave the flight before dropping the cancellation flag, so a cancelled job
+    # is never counted as an active participant again
+    temp_dir = job['temp_dir']
+    if job['flight'] is not None:
+        temp_dir = download_flights.release(job['flight'], job['id'])
+    cancellations.unregister(job['id'])
+    if temp_dir and not retrying and os.path.exists(temp_dir):
+        try:
+            import shutil
+            shutil.rmtree(temp_dir)
+            logger.debug("TEMP DIR REMOVED: %s", temp_dir)
+        except Exception as e:
+            logger.error("FAILED TO REMOVE TEMP DIR: %s", e)
 
+# Format policy of a download: its request's settings over its user's over DEFAULT_FORMAT_POLICY
+def download_format_policy(download_id):
+    row = db.query(
+        "SELECT d.format_policy, u.format_policy AS user_policy FROM downloads d "
+        "LEFT JOIN users u ON u.id = d.user_id WHERE d.id = ?",
+        (download_id,), one=True
+    ) or {}
+    layers = [json.loads(row[column]) for column in ('user_policy', 'format_policy') if row.get(column)]
+    return FormatPolicy.from_layers(DEFAULT_FORMAT_POLICY, *layers)
 
+# Download function run by the scheduler's worker threads. It does the network part of
+# a job; once the file, or its separate streams, are on disk the job is handed to the
+# post-processing pool and the worker moves on to the next transfer.
 def download_video(download_id, url, target_path):
-    temp_dir = os.path.join(DOWNLOAD_DIR, download_id)
+    job = {
+        'id': download_id,
+        'target_path': target_path,
+        'temp_dir': os.path.join(STAGING_DIR, download_id),
+        'info': None,
+        'video_keys': [canonical_video_key(url)],
+        'format_key': None,
+        'flight': None,
+        'ydl': None,  # holds the pending merge when this job leads a download
+        'filename': None,
+    }
+    retry = None
+    handed_off = False
+    cancellations.register(download_id)
+    # Tag every log record from this thread with the download
+    log_context = current_download.set(download_id)
     try:
-        logger.info(f"DOWNLOAD START: ID={download_id}, URL={url}, TARGET={target_path}")
-        
-        # Create temp directory
-        os.makedirs(temp_dir, exist_ok=True)
-        logger.info(f"TEMP DIR CREATED: {temp_dir}")
-        
-        # Set yt-dlp options
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'merge_output_format': 'mp4',
-            'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-            'progress_hooks': [lambda d: progress_hook(d, download_id)],
-        }
+        logger.info("DOWNLOAD START: URL=%s, TARGET=%s", url, target_path)
+        cancellations.check(download_id)
         
         # Start download
         update_download_status(download_id, 'downloading', 0)
-        logger.info(f"STATUS UPDATED: downloading")
-        
-        # Download the video
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"DOWNLOAD STARTED WITH YT-DLP")
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            logger.info(f"DOWNLOAD COMPLETED: {filename}")
+        
+        # Serve videos already in the library under this policy without touching the network
+        policy = download_format_policy(download_id)
+        job['format_key'] = policy.key
+        video_keys = job['video_keys']
+        entry = library.lookup(video_keys[0], policy.key)
+        if entry is None:
+            # Jobs for the same video share one extraction and one transfer
+            info = info_cache.get_or_extract(url, extract_video_info)
+            if info_video_key(info) not in video_keys:
+                video_keys.append(info_video_key(info))
+                entry = library.lookup(video_keys[1], policy.key)
             
-            # Check if file exists
-            if not os.path.exists(filename):
-                # Try with mp4 extension
-                mp4_filename = f"{filename.rsplit('.', 1)[0]}.mp4"
-                if os.path.exists(mp4_filename):
-                    filename = mp4_filename
-                    logger.info(f"USING MP4 FILENAME: {filename}")
-        
-        # Verify file exists
-        if not os.path.exists(filename):
-            logger.error(f"ERROR: FILE NOT FOUND AT {filename}")
-            files = os.listdir(temp_dir)
-            logger.error(f"FILES IN TEMP DIR: {files}")
-            raise FileNotFoundError(f"Downloaded file not found at {filename}")
-        
-        # Get video aspect ratio using ffprobe
-        aspect_ratio = "Unknown"
-        try:
-            import subprocess
-            result = subprocess.run(
-                ['ffprobe', '-v', 'error', '-select_streams', 'v:0', 
-                 '-show_entries', 'stream=width,height', '-of', 'csv=s=x:p=0', filename],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            if result.stdout:
-                width, height = result.stdout.strip().split('x')
-                if width and height:
-                    # Calculate aspect ratio and simplify
-                    import math
-                    gcd = math.gcd(int(width), int(height))
-                    aspect_w = int(width) // gcd
-                    aspect_h = int(height) // gcd
-                    aspect_ratio = f"{aspect_w}:{aspect_h}"
-                    logger.info(f"DETECTED ASPECT RATIO: {aspect_ratio} ({width}x{height})")
-        except Exception as e:
-            logger.warning(f"Could not determine aspect ratio: {str(e)}")
+            # The cheapest formats meeting the policy, chosen from the extracted list
+            formats = policy.select(info)
+            spec = format_spec(formats) if formats else policy.fallback_spec()
+            info = job['info'] = selected_info(info, formats) if formats else info
+            logger.info("FORMATS %s FOR POLICY %s", spec, policy.key)
         
-        # Store aspect ratio in database
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE downloads SET aspect_ratio = ? WHERE id = ?",
-            (aspect_ratio, download_id)
-        )
-        conn.commit()
-        conn.close()
+        if entry is not None:
+            job['filename'] = entry['path']
+            disk_space.reserve(download_id, space_needs(job['info'], os.path.dirname(entry['path']),
+                                                        size=entry['size']))
+            logger.info("USING LIBRARY COPY: %s", entry['path'])
+        else:
+            # Policies that resolve to the same formats share the download
+            flight, is_leader = download_flights.join(f"{video_keys[-1]}:{spec}", download_id, job['temp_dir'])
+            job['flight'] = flight
+            cancellations.on_cancel(download_id, lambda: abort_flight(flight))
+            if is_leader:
+                try:
+                    disk_space.reserve(download_id, space_needs(info, STAGING_DIR, job['temp_dir']))
+                    job['ydl'] = fetch_video(info, spec, job['temp_dir'], flight)
+                except Exception as e:
+                    download_flights.fail(flight, e)
+                    raise
+            else:
+                disk_space.reserve(download_id, space_needs(info, STAGING_DIR))
+                job['filename'] = flight.wait(check=lambda: cancellations.check(download_id))
+                logger.info("USING SHARED DOWNLOAD FROM %s: %s", flight.leader, job['filename'])
+        
+        # Merging, probing and finalizing happen on the post-processing pool
+        cancellations.check(download_id)
+        update_download_status(download_id, 'processing', 100)
+        postprocessing.submit(download_id, process_download, job)
+        handed_off = True
         
-        # Check file size
-        file_size = os.path.getsize(filename)
-        logger.info(f"FILE SIZE: {file_size} bytes")
+    except Exception as e:
+        retry = handle_job_error(download_id, e)
+    finally:
+        current_download.reset(log_context)
+        if not handed_off:
+            release_job(job, retry is not None)
+    
+    if retry is not None:
+        raise RetryDownload(*retry)
+
+# Post-processing run on the post-processing pool once a job's data is on disk:
+# the merge of separate streams, media metadata, checksum and finalize
+def process_download(job):
+    download_id = job['id']
+    flight = job['flight']
+    info = job['info']
+    retry = None
+    log_context = current_download.set(download_id)
+    try:
+        filename = job['filename']
+        if job['ydl'] is not None:
+            # The leader merges the download and hands the file to the jobs sharing it
+            try:
+                check_flight_cancelled(flight)
+                filename = merge_video(job['ydl'], job['temp_dir'])
+            except Exception as e:
+                download_flights.fail(flight, e)
+                raise
+            download_flights.resolve(flight, filename)
+        cancellations.check(download_id)
+        
+        # Media metadata comes from yt-dlp's info, with ffprobe only as a fallback
+        metadata = info_metadata(info) if info else None
+        if metadata is None:
+            try:
+                with stage_seconds.time(stage='ffprobe'):
+                    metadata = media_probe.probe(filename)
+            except Exception as e:
+                logger.warning("Could not determine media metadata: %s", e)
+                metadata = {}
+        logger.debug("MEDIA METADATA: %s", metadata)
         
         # Get original filename from the downloaded file
         original_filename = os.path.basename(filename)
-        logger.info(f"ORIGINAL FILENAME: {original_filename}")
+        logger.debug("ORIGINAL FILENAME: %s", original_filename)
         
         # Determine target location based on path type
+        target_path = job['target_path']
         if target_path.endswith('.mp4'):
             # User provided a full filename
             target_file = os.path.join(TARGET_DIR, target_path)
-            logger.info(f"User provided specific filename: {target_path}")
+            logger.debug("User provided specific filename: %s", target_path)
         else:
             # User provided a directory - append original filename
             if not target_path.endswith('/'):
                 target_path += '/'
             target_file = os.path.join(TARGET_DIR, target_path, original_filename)
-            logger.info(f"User provided directory path: {target_path}, appending original filename: {original_filename}")
+            logger.debug("User provided directory path: %s, appending original filename: %s",
+                         target_path, original_filename)
         
-        logger.info(f"TARGET FILE PATH: {target_file}")
+        logger.debug("TARGET FILE PATH: %s", target_file)
         
         # Create target directory
         target_dir = os.path.dirname(target_file)
-        logger.info(f"CREATING TARGET DIR: {target_dir}")
+        logger.debug("CREATING TARGET DIR: %s", target_dir)
         os.makedirs(target_dir, exist_ok=True)
         
         # Check if target dir exists
         if not os.path.isdir(target_dir):
-            logger.error(f"ERROR: TARGET DIR NOT CREATED: {target_dir}")
+            logger.error("ERROR: TARGET DIR NOT CREATED: %s", target_dir)
             raise OSError(f"Failed to create target directory: {target_dir}")
         
         # Check permissions
@@ -293,62 +840,70 @@ def download_video(download_id, url, target_path):
             with open(test_file, 'w') as f:
                 f.write("test")
             os.remove(test_file)
-            logger.info(f"TARGET DIR IS WRITABLE: {target_dir}")
+            logger.debug("TARGET DIR IS WRITABLE: %s", target_dir)
         except Exception as e:
-            logger.warning(f"WARNING: TARGET DIR NOT WRITABLE: {target_dir}, Error: {str(e)}")
-            logger.info(f"ATTEMPTING TO FIX PERMISSIONS ON: {target_dir}")
+            logger.warning("TARGET DIR NOT WRITABLE: %s, Error: %s; attempting to fix permissions", target_dir, e)
             os.chmod(target_dir, 0o777)
         
         # Move file
+        cancellations.check(download_id)
         update_download_status(download_id, 'moving', 100)
-        logger.info(f"STATUS UPDATED: moving")
-        logger.info(f"MOVING FILE: {filename} -> {target_file}")
+        logger.debug("MOVING FILE: %s -> %s", filename, target_file)
         
-        import shutil
-        shutil.copy2(filename, target_file)
-        logger.info(f"FILE COPIED SUCCESSFULLY")
+        # Library files and downloads other jobs still need are linked or copied instead of moved
+        with stage_seconds.time(stage='finalize'):
+            file_size, checksum = finalize_file(filename, target_file, checksum=FINALIZE_CHECKSUM,
+                                                keep_source=flight is None or flight.shared)
+        logger.info("FILE FINALIZED: %s (%d bytes, sha256=%s)", target_file, file_size, checksum)
         
-        # Verify copied file
-        if os.path.exists(target_file):
-            copied_size = os.path.getsize(target_file)
-            logger.info(f"COPIED FILE SIZE: {copied_size} bytes")
-            
-            if copied_size == file_size:
-                logger.info(f"FILE SIZES MATCH")
-            else:
-                logger.warning(f"WARNING: FILE SIZES DON'T MATCH: {file_size} vs {copied_size}")
-        else:
-            logger.error(f"ERROR: COPIED FILE NOT FOUND AT {target_file}")
-            raise FileNotFoundError(f"Copied file not found at {target_file}")
-        
-        # Clean up original file
-        os.remove(filename)
-        logger.info(f"ORIGINAL FILE REMOVED")
+        if flight is not None:
+            library.record(job['video_keys'], job['format_key'], target_file, checksum)
         
-        # Update status to completed
-        update_download_status(download_id, 'completed', 100)
-        logger.info(f"STATUS UPDATED: completed")
-        logger.info(f"DOWNLOAD PROCESS COMPLETE")
+        # Update status to completed, storing the metadata in the same write
+        update_download_status(download_id, 'completed', 100, file_size=file_size, **metadata)
         
     except Exception as e:
-        logger.error(f"ERROR IN DOWNLOAD: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
-        update_download_status(download_id, 'failed', 0)
-        logger.info(f"STATUS UPDATED: failed")
+        retry = handle_job_error(download_id, e)
     finally:
-        # Clean up
-        if download_id in active_downloads:
-            del active_downloads[download_id]
-        
-        # Remove temp directory
-        if os.path.exists(temp_dir):
-            try:
-                import shutil
-                shutil.rmtree(temp_dir)
-                logger.info(f"TEMP DIR REMOVED: {temp_dir}")
-            except Exception as e:
-                logger.error(f"FAILED TO REMOVE TEMP DIR: {str(e)}")
+        current_download.reset(log_context)
+        release_job(job, retry is not None)
+    
+    # The worker that claims the job again redoes only what is missing from its temp dir
+    if retry is not None:
+        job_queue.requeue(download_id, retry[0])
+
+# Download scheduler; active_downloads holds every queued or running job
+scheduler = DownloadScheduler(download_video, MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_USER)
+active_downloads = scheduler.jobs
+metrics.gauge('ytdl_queue_depth', 'Downloads waiting for a worker',
+              func=lambda: sum(1 for job in list(active_downloads.values()) if job['state'] == 'queued'))
+metrics.gauge('ytdl_active_downloads', 'Downloads running on a worker',
+              func=lambda: sum(1 for job in list(active_downloads.values()) if job['state'] == 'running'))
+
+# Downloads whose data is on disk, waiting for or running their merge, probe and finalize
+postprocessing = PostProcessingPool(POSTPROCESS_WORKERS)
+metrics.gauge('ytdl_postprocess_queue_depth', 'Downloads waiting for a post-processing worker',
+              func=lambda: sum(1 for job in list(postprocessing.jobs.values()) if job['state'] == 'queued'))
+metrics.gauge('ytdl_postprocess_active', 'Downloads being merged, probed or finalized',
+              func=lambda: sum(1 for job in list(postprocessing.jobs.values()) if job['state'] == 'running'))
+
+# Claims downloads from the database with leases, so several worker processes
+# can share the queue and abandoned downloads are picked up again. Partial files
+# stay in their temp directories, so yt-dlp resumes where the last attempt stopped.
+job_queue = JobQueue(
+    db, scheduler,
+    lambda row: enqueue_download(row['id'], row['user_id'], row['url'], row['target_path'], row['priority']),
+    stop_local_download,
+    LEASE_TTL, QUEUE_POLL_INTERVAL,
+    postprocessing, bandwidth
+)
+
+# Archives old history and runs ANALYZE/VACUUM
+retention = RetentionManager(db, HISTORY_RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_INTERVAL,
+                             ANALYZE_INTERVAL, VACUUM_INTERVAL)
+
+# Expands bulk uploads into queued downloads for the job queue to claim
+batch_ingestor = BatchIngestor(db, expand_playlist, job_queue.owner, BATCH_INSERT_SIZE, MAX_BATCH_JOBS)
 
 # Routes
 @app.route('/api/login', methods=['POST'])
@@ -358,34 +913,28 @@ def login():
     if not auth or not auth.get('username') or not auth.get('password'):
         return jsonify({'message': 'Could not verify'}), 401
     
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, password, is_admin FROM users WHERE username = ?", (auth.get('username'),))
-    user = cursor.fetchone()
-    conn.close()
+    user = db.query(
+        "SELECT id, username, password, is_admin FROM users WHERE username = ?",
+        (auth.get('username'),), one=True
+    )
     
-    if not user or not check_password_hash(user[2], auth.get('password')):
+    if not user or not check_password_hash(user['password'], auth.get('password')):
         return jsonify({'message': 'Invalid credentials'}), 401
     
     token = jwt.encode({
-        'user_id': user[0],
-        'username': user[1],
-        'is_admin': user[3],
+        'user_id': user['id'],
+        'username': user['username'],
+        'is_admin': user['is_admin'],
         'exp': datetime.utcnow().timestamp() + 24 * 3600  # 24 hour expiry
     }, SECRET_KEY)
     
-    return jsonify({'token': token, 'username': user[1], 'is_admin': user[3]})
+    return jsonify({'token': token, 'username': user['username'], 'is_admin': user['is_admin']})
 
 @app.route('/api/users', methods=['GET'])
 @token_required
 @admin_required
 def get_users(current_user_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, is_admin, created_at FROM users")
-    users = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    users = db.query("SELECT id, username, is_admin, created_at FROM users")
     
     return jsonify(users)
 
@@ -401,21 +950,17 @@ def create_user(current_user_id):
     hashed_password = generate_password_hash(data.get('password'))
     is_admin = data.get('is_admin', False)
     
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute(
+        cursor = db.execute(
             "INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
             (data.get('username'), hashed_password, is_admin)
         )
-        conn.commit()
         user_id = cursor.lastrowid
-        conn.close()
+        # Drop any cached "no such user" entry for the new ID
+        auth_cache.invalidate_user(user_id)
         
         return jsonify({'id': user_id, 'username': data.get('username'), 'is_admin': is_admin}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'message': 'Username already exists'}), 409
 
 @app.route('/api/users/<int:user_id>', methods=['DELETE'])
@@ -425,14 +970,17 @@ def delete_user(current_user_id, user_id):
     if user_id == current_user_id:
         return jsonify({'message': 'Cannot delete yourself'}), 400
     
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    db.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    auth_cache.invalidate_user(user_id)
     
     return jsonify({'message': 'User deleted'})
 
+# Limit a requested priority to the user's range; only admins can push jobs ahead of other users
+def clamp_priority(user_id, priority):
+    user = auth_cache.user(user_id)
+    max_priority = MAX_PRIORITY if user and user['is_admin'] else 0
+    return max(-MAX_PRIORITY, min(priority, max_priority))
+
 @app.route('/api/downloads', methods=['POST'])
 @token_required
 def start_download(current_user_id):
@@ -444,136 +992,441 @@ def start_download(current_user_id):
     urls = data.get('urls')
     target_paths = data.get('targetPaths')
     
-    logger.info(f"Download request received: {urls} -> {target_paths}")
+    logger.info("Download request received: %s -> %s", urls, target_paths)
     
     if len(urls) != len(target_paths) or len(urls) > 5:
-        logger.warning(f"Invalid request: {len(urls)} URLs, {len(target_paths)} paths")
+        logger.warning("Invalid request: %d URLs, %d paths", len(urls), len(target_paths))
         return jsonify({'message': 'Invalid number of URLs or target paths'}), 400
     
-    download_ids = []
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        return jsonify({'message': 'Priority must be an integer'}), 400
+    priority = clamp_priority(current_user_id, priority)
+    
+    # Settings that override the user's format policy for these downloads only
+    format_policy = None
+    if data.get('formatPolicy') is not None:
+        try:
+            overrides = parse_policy(data['formatPolicy'])
+        except FormatPolicyError as e:
+            return jsonify({'message': str(e)}), 400
+        format_policy = json.dumps(overrides) if overrides else None
     
+    download_ids = []
+    rows = []
     for i, url in enumerate(urls):
         download_id = str(uuid.uuid4())
         target_path = target_paths[i]
         
-        logger.info(f"Creating download job {download_id}: {url} -> {target_path}")
-        
-        cursor.execute(
-            "INSERT INTO downloads (id, user_id, url, target_path, status) VALUES (?, ?, ?, ?, ?)",
-            (download_id, current_user_id, url, target_path, 'queued')
-        )
-        
-        # Start download in a separate thread
-        download_thread = threading.Thread(
-            target=download_video, 
-            args=(download_id, url, target_path)
-        )
-        download_thread.daemon = True
-        download_thread.start()
+        logger.debug("Creating download job %s: %s -> %s", download_id, url, target_path)
         
-        active_downloads[download_id] = download_thread
+        rows.append((download_id, current_user_id, url, target_path, 'queued', priority, format_policy))
         download_ids.append(download_id)
     
-    conn.commit()
-    conn.close()
+    # With local workers the jobs are leased to this process and start right away;
+    # a web-only process leaves them for the worker processes to claim
+    lease_owner, lease_expires = job_queue.new_lease() if job_queue.running else (None, None)
+    db.executemany(
+        "INSERT INTO downloads (id, user_id, url, target_path, status, priority, format_policy, "
+        "lease_owner, lease_expires) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [row + (lease_owner, lease_expires) for row in rows]
+    )
+    
+    # Hand the jobs to the worker pool once the rows are visible to it
+    for i, download_id in enumerate(download_ids):
+        if job_queue.running:
+            enqueue_download(download_id, current_user_id, urls[i], target_paths[i], priority)
+        else:
+            progress_store.register(download_id, current_user_id)
     
     return jsonify({'download_ids': download_ids})
 
-@app.route('/api/downloads', methods=['GET'])
+# Bulk upload of NDJSON lines ({"url": ..., "targetPath": ...}) or CSV rows (url,targetPath);
+# playlists and channels are expanded in the background, so this returns right away
+@app.route('/api/batches', methods=['POST'])
 @token_required
-def get_downloads(current_user_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+def create_batch(current_user_id):
+    try:
+        priority = int(request.args.get('priority', 0))
+    except ValueError:
+        return jsonify({'message': 'Priority must be an integer'}), 400
+    
+    try:
+        entries = parse_entries(request.stream, request.content_type, MAX_BATCH_ENTRIES)
+    except (BatchFormatError, UnicodeDecodeError) as e:
+        return jsonify({'message': str(e)}), 400
+    
+    batch_id = batch_ingestor.create(current_user_id, entries, clamp_priority(current_user_id, priority))
+    logger.info("Batch %s created with %d entries", batch_id, len(entries))
+    return jsonify({'batch_id': batch_id, 'entries': len(entries)}), 202
+
+# Aggregate progress of a bulk upload's downloads
+@app.route('/api/batches/<batch_id>', methods=['GET'])
+@token_required
+def get_batch(current_user_id, batch_id):
+    batch = batch_ingestor.status(batch_id, current_user_id)
+    if batch is None:
+        return jsonify({'message': 'Batch not found'}), 404
+    return jsonify(batch)
+
+# The user's own format policy (or, for admins, that of ?user_id=) and the policy
+# it adds up to with DEFAULT_FORMAT_POLICY
+def format_policy_response(user_id):
+    row = db.query("SELECT format_policy FROM users WHERE id = ?", (user_id,), one=True)
+    if row is None:
+        return jsonify({'message': 'User not found'}), 404
+    policy = json.loads(row['format_policy']) if row['format_policy'] else {}
+    return jsonify({
+        'user_id': user_id,
+        'policy': policy,
+        'effective': FormatPolicy.from_layers(DEFAULT_FORMAT_POLICY, policy).to_dict(),
+    })
+
+# Whose format policy a request addresses, or an error response; only admins may name
+# another user with ?user_id=
+def format_policy_user(current_user_id):
+    try:
+        user_id = admin_history_user_filter() or current_user_id
+    except ValueError:
+        return None, (jsonify({'message': 'Invalid user_id'}), 400)
+    if user_id != current_user_id and not auth_cache.user(current_user_id)['is_admin']:
+        return None, (jsonify({'message': 'Admin privileges required!'}), 403)
+    return user_id, None
+
+@app.route('/api/format-policy', methods=['GET'])
+@token_required
+def get_format_policy(current_user_id):
+    user_id, error = format_policy_user(current_user_id)
+    if error:
+        return error
+    return format_policy_response(user_id)
+
+# Replace a user's default format policy; fields left out fall back to DEFAULT_FORMAT_POLICY
+@app.route('/api/format-policy', methods=['PUT'])
+@token_required
+def set_format_policy(current_user_id):
+    user_id, error = format_policy_user(current_user_id)
+    if error:
+        return error
+    
+    try:
+        policy = parse_policy(request.get_json() or {})
+    except FormatPolicyError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    db.execute("UPDATE users SET format_policy = ? WHERE id = ?", (json.dumps(policy) if policy else None, user_id))
+    return format_policy_response(user_id)
+
+@app.route('/api/downloads/queue', methods=['GET'])
+@token_required
+@admin_required
+def get_download_queue(current_user_id):
+    queue = scheduler.snapshot()
+    queue['postprocessing'] = postprocessing.snapshot()
+    queue['disk_space'] = disk_space.snapshot()
+    return jsonify(queue)
+
+@app.route('/api/bandwidth', methods=['GET'])
+@token_required
+@admin_required
+def get_bandwidth(current_user_id):
+    bandwidth.load()
+    return jsonify(bandwidth.snapshot())
+
+@app.route('/api/bandwidth', methods=['PUT'])
+@token_required
+@admin_required
+def set_bandwidth(current_user_id):
+    data = request.get_json() or {}
+    
+    total_rate = data.get('totalRate')
+    if total_rate is not None and (not isinstance(total_rate, int) or isinstance(total_rate, bool) or total_rate < 0):
+        return jsonify({'message': 'totalRate must be a non-negative integer (bytes/sec, 0 for unlimited)'}), 400
+    
+    fragments = data.get('fragmentConcurrency')
+    if fragments is not None and (not isinstance(fragments, int) or isinstance(fragments, bool)
+                                  or not 1 <= fragments <= MAX_FRAGMENT_CONCURRENCY):
+        return jsonify({'message': f'fragmentConcurrency must be between 1 and {MAX_FRAGMENT_CONCURRENCY}'}), 400
+    
+    # Workers pick the new limits up on their next queue poll
+    bandwidth.save(total_rate, fragments)
+    return jsonify(bandwidth.snapshot())
+
+# Parse a from/to query value; a bare date as the upper bound includes that whole day
+def parse_history_timestamp(value, upper=False):
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+    if upper and len(value) == 10:
+        timestamp += timedelta(days=1)
+    return timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+# Build the WHERE clauses shared by the history list and summary endpoints
+def build_history_filters(args, user_id=None):
+    clauses = []
+    params = []
+    
+    if user_id is not None:
+        clauses.append("d.user_id = ?")
+        params.append(user_id)
     
-    cursor.execute("""
+    statuses = [status for status in args.get('status', '').split(',') if status]
+    if statuses:
+        clauses.append(f"d.status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    
+    if args.get('from'):
+        clauses.append("d.created_at >= ?")
+        params.append(parse_history_timestamp(args['from']))
+    if args.get('to'):
+        clauses.append("d.created_at < ?")
+        params.append(parse_history_timestamp(args['to'], upper=True))
+    
+    return clauses, params
+
+def encode_history_cursor(row):
+    return base64.urlsafe_b64encode(f"{row['created_at']}|{row['id']}".encode()).decode()
+
+def decode_history_cursor(cursor):
+    try:
+        created_at, download_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    return created_at, download_id
+
+# Return one page of history, newest first, continuing after ?cursor=
+def list_history(user_id=None):
+    try:
+        clauses, params = build_history_filters(request.args, user_id)
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        if request.args.get('cursor'):
+            clauses.append("(d.created_at, d.id) < (?, ?)")
+            params.extend(decode_history_cursor(request.args['cursor']))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = db.query(f"""
         SELECT d.*, u.username 
         FROM downloads d 
         JOIN users u ON d.user_id = u.id 
-        WHERE d.user_id = ? 
-        ORDER BY d.created_at DESC
-    """, (current_user_id,))
+        {where}
+        ORDER BY d.created_at DESC, d.id DESC
+        LIMIT ?
+    """, params + [limit + 1])
     
-    downloads = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    next_cursor = encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    downloads = progress_store.overlay(rows[:limit])
     
-    return jsonify(downloads)
+    return jsonify({'downloads': downloads, 'next_cursor': next_cursor})
+
+# Count downloads matching the history filters, grouped by status
+def summarize_history(user_id=None):
+    try:
+        clauses, params = build_history_filters(request.args, user_id)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = db.query(f"SELECT d.status, COUNT(*) AS count FROM downloads d {where} GROUP BY d.status", params)
+    by_status = {row['status']: row['count'] for row in rows}
+    
+    return jsonify({'total': sum(by_status.values()), 'by_status': by_status})
+
+def admin_history_user_filter():
+    user_id = request.args.get('user_id')
+    if user_id is None or user_id == '':
+        return None
+    return int(user_id)
+
+@app.route('/api/downloads', methods=['GET'])
+@token_required
+def get_downloads(current_user_id):
+    return list_history(current_user_id)
+
+@app.route('/api/downloads/summary', methods=['GET'])
+@token_required
+def get_downloads_summary(current_user_id):
+    return summarize_history(current_user_id)
 
 @app.route('/api/downloads/all', methods=['GET'])
 @token_required
 @admin_required
 def get_all_downloads(current_user_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    try:
+        user_id = admin_history_user_filter()
+    except ValueError:
+        return jsonify({'message': 'Invalid user_id'}), 400
+    return list_history(user_id)
+
+@app.route('/api/downloads/all/summary', methods=['GET'])
+@token_required
+@admin_required
+def get_all_downloads_summary(current_user_id):
+    try:
+        user_id = admin_history_user_filter()
+    except ValueError:
+        return jsonify({'message': 'Invalid user_id'}), 400
+    return summarize_history(user_id)
+
+# Usage per day and per user between ?from= and ?to= (dates, inclusive), optionally
+# for one ?user_id=; read from the precomputed aggregates, so it covers archived history
+@app.route('/api/stats', methods=['GET'])
+@token_required
+@admin_required
+def get_stats(current_user_id):
+    try:
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d') if request.args.get('to') else datetime.utcnow()
+        start = (datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from')
+                 else end - timedelta(days=DEFAULT_STATS_DAYS - 1))
+        user_id = admin_history_user_filter()
+    except ValueError:
+        return jsonify({'message': 'Dates must be YYYY-MM-DD and user_id an integer'}), 400
     
-    cursor.execute("""
-        SELECT d.*, u.username 
-        FROM downloads d 
-        JOIN users u ON d.user_id = u.id 
-        ORDER BY d.created_at DESC
-    """)
+    return jsonify(usage_stats(db, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), user_id))
+
+@app.route('/api/downloads/status', methods=['GET'])
+@token_required
+def get_download_statuses(current_user_id):
+    ids = [download_id for download_id in request.args.get('ids', '').split(',') if download_id]
     
-    downloads = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    if not ids or len(ids) > MAX_STATUS_IDS:
+        return jsonify({'message': f'Provide between 1 and {MAX_STATUS_IDS} download ids'}), 400
+    
+    placeholders = ','.join('?' * len(ids))
+    downloads = progress_store.overlay(db.query(
+        f"SELECT * FROM downloads WHERE user_id = ? AND id IN ({placeholders})",
+        [current_user_id] + ids
+    ))
     
     return jsonify(downloads)
 
+@app.route('/api/downloads/stream', methods=['GET'])
+@token_required
+def stream_downloads(current_user_id):
+    # Downloads the client is waiting for; their current state is sent on connect, so
+    # ones that finished before the stream opened are reported too
+    watched = [download_id for download_id in request.args.get('ids', '').split(',') if download_id]
+    watched = watched[:MAX_STATUS_IDS]
+    
+    def fetch_states(ids):
+        placeholders = ','.join('?' * len(ids))
+        return progress_store.overlay(db.query(
+            f"SELECT id, status, progress, aspect_ratio, updated_at FROM downloads WHERE user_id = ? AND id IN ({placeholders})",
+            [current_user_id] + list(ids)
+        ))
+    
+    def events():
+        sent = {}
+        if watched:
+            rows = fetch_states(watched)
+            for row in rows:
+                if row['status'] not in TERMINAL_STATES:
+                    sent[row['id']] = {'status': row['status'], 'progress': row['progress']}
+            if rows:
+                yield f"event: progress\ndata: {json.dumps(rows)}\n\n"
+        
+        version = None
+        last_event = time.monotonic()
+        missing = list(sent)
+        while True:
+            # Queued downloads change in the database without a store change, e.g. a
+            # library hit completes before the mirror sees it run, so poll for them
+            version = progress_store.wait(version, STREAM_DB_INTERVAL if missing else STREAM_KEEPALIVE)
+            live = progress_store.snapshot(current_user_id)
+            
+            changes = []
+            for download_id, state in live.items():
+                if sent.get(download_id) != state:
+                    sent[download_id] = state
+                    changes.append(dict(state, id=download_id))
+            
+            # Downloads that are not in the store have usually reached a terminal state
+            # in the database; the rest are reported whenever their state changes
+            missing = [download_id for download_id in sent if download_id not in live]
+            if missing:
+                rows = fetch_states(missing)
+                for download_id in set(missing) - {row['id'] for row in rows}:
+                    del sent[download_id]
+                for row in rows:
+                    state = {'status': row['status'], 'progress': row['progress']}
+                    if row['status'] in TERMINAL_STATES:
+                        del sent[row['id']]
+                    elif sent[row['id']] == state:
+                        continue
+                    else:
+                        sent[row['id']] = state
+                    changes.append(row)
+            
+            if changes:
+                yield f"event: progress\ndata: {json.dumps(changes)}\n\n"
+                last_event = time.monotonic()
+            elif time.monotonic() - last_event >= STREAM_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_event = time.monotonic()
+            
+            # Coalesce bursts of progress hooks into one event per interval
+            time.sleep(STREAM_MIN_INTERVAL)
+    
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.route('/api/downloads/<download_id>', methods=['GET'])
 @token_required
 def get_download_status(current_user_id, download_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    download = progress_store.get(download_id)
+    if download and download['user_id'] == current_user_id:
+        return jsonify(download)
     
-    cursor.execute(
+    download = db.query(
         "SELECT * FROM downloads WHERE id = ? AND user_id = ?",
-        (download_id, current_user_id)
+        (download_id, current_user_id), one=True
     )
     
-    download = cursor.fetchone()
-    conn.close()
-    
     if not download:
         return jsonify({'message': 'Download not found'}), 404
     
-    return jsonify(dict(download))
+    progress_store.track(download)
+    return jsonify(progress_store.get(download_id) or download)
+
+@app.route('/api/library/rebuild', methods=['POST'])
+@token_required
+@admin_required
+def rebuild_library(current_user_id):
+    return jsonify(library.rebuild())
 
 @app.route('/api/downloads/<download_id>/cancel', methods=['POST'])
 @token_required
 def cancel_download(current_user_id, download_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute(
+    download = db.query(
         "SELECT status FROM downloads WHERE id = ? AND user_id = ?",
-        (download_id, current_user_id)
+        (download_id, current_user_id), one=True
     )
     
-    download = cursor.fetchone()
-    
     if not download:
-        conn.close()
         return jsonify({'message': 'Download not found'}), 404
     
-    if download[0] in ['completed', 'failed', 'cancelled']:
-        conn.close()
+    if download['status'] in TERMINAL_STATES:
         return jsonify({'message': 'Download already finished or cancelled'}), 400
     
     # Update status to cancelled
-    cursor.execute(
+    db.execute(
         "UPDATE downloads SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
         (download_id,)
     )
+    # Worker processes notice the cancelled status on their next poll
+    stop_local_download(download_id)
     
-    conn.commit()
-    conn.close()
-    
-    # Thread will detect cancellation on next progress update
     return jsonify({'message': 'Download cancelled'})
 
+# Prometheus metrics for this process
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 # Serve React frontend
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -583,6 +1436,48 @@ def serve(path):
     else:
         return send_from_directory(app.static_folder, 'index.html')
 
-if __name__ == '__main__':
+# Start the background services for a process role: 'web' serves the API and
+# mirrors progress from the database, 'worker' only runs downloads, 'all' does both
+def start_services(mode='all'):
     init_db()
-    app.run(host='0.0.0.0', port=4000)
+    if mode == 'web':
+        progress_store.start(mirror=True)
+        return
+    progress_store.start()
+    ytdl_pool.start()
+    scheduler.start()
+    job_queue.start()
+    batch_ingestor.start()
+    disk_space.start()
+    retention.start()
+    if mode == 'worker' and WORKER_METRICS_PORT:
+        serve_worker_metrics()
+
+# Serve /metrics on the first free port from WORKER_METRICS_PORT; a worker that
+# finds none keeps running without it
+def serve_worker_metrics():
+    for port in range(WORKER_METRICS_PORT, WORKER_METRICS_PORT + WORKER_METRICS_PORTS):
+        try:
+            metrics.serve(port)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE:
+                logger.warning("Worker metrics not served: %s", e)
+                return
+            continue
+        logger.info("Worker metrics on port %d", port)
+        return
+    logger.warning("Worker metrics not served: ports %d-%d are in use",
+                   WORKER_METRICS_PORT, WORKER_METRICS_PORT + WORKER_METRICS_PORTS - 1)
+
+if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'all'
+    if mode not in ('all', 'web', 'worker'):
+        sys.exit("Usage: python app.py [all|web|worker]")
+    
+    start_services(mode)
+    if mode == 'worker':
+        # Downloads run on the scheduler's threads; keep the process alive
+        while True:
+            time.sleep(3600)
+    else:
+        app.run(host='0.0.0.0', port=4000)
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+
+def create_user_triggers(cursor):
+    """Count every change to ``users`` that affects logins in the ``settings`` table, whichever process makes it."""
+    # Other columns, such as a user's format policy, do not concern the auth caches;
+    # databases created before the update trigger listed its columns get it replaced
+    cursor.execute("DROP TRIGGER IF EXISTS users_version_update")
+    events = {'insert': 'INSERT', 'update': 'UPDATE OF username, password, is_admin', 'delete': 'DELETE'}
+    for name, event in events.items():
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_version_{name} AFTER {event} ON users
+        BEGIN
+            INSERT INTO settings (name, value) VALUES ('users_version', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END
+        ''')
+
+
+class AuthCache:
+    """TTL/LRU cache of verified tokens and user privilege records.
+
+    A token is decoded once and then served from memory until its TTL or its
+    own ``exp`` claim runs out, whichever comes first. User records (including
+    "no such user") are cached the same way so ``admin_required`` and the
+    deleted-user check do not touch the database on every request.
+
+    Triggers count changes to users in the ``settings`` table, and the cache
+    reads that count at most every ``check_interval`` seconds and starts over
+    when it moved, so a user deleted or demoted through any process loses
+    access everywhere within that time. Routes that change users also call
+    ``invalidate_user`` so the change applies at once in their own process.
+    """
+
+    def __init__(self, db, secret, ttl=60, max_entries=1024, check_interval=1.0):
+        self.db = db
+        self.secret = secret
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()  # token -> (expires_at, user_id)
+        self._users = OrderedDict()   # user_id -> (expires_at, user record or None)
+        self._version = None
+        self._checked_at = None
+
+    def _get(self, entries, key):
+        # Caller must hold self._lock
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return entry
+
+    def _put(self, entries, key, expires_at, value):
+        # Caller must hold self._lock
+        entries[key] = (expires_at, value)
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def _check_version(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+        row = self.db.query("SELECT value FROM settings WHERE name = 'users_version'", one=True)
+        version = row['value'] if row else None
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._tokens.clear()
+                self._users.clear()
+
+    def authenticate(self, token):
+        """Return the user a token belongs to, or None if it is invalid, expired or the user is gone."""
+        self._check_version()
+        with self._lock:
+            entry = self._get(self._tokens, token)
+        if entry is not None:
+            user_id = entry[1]
+        else:
+            try:
+                data = jwt.decode(token, self.secret, algorithms=['HS256'])
+                user_id = data['user_id']
+            except (jwt.InvalidTokenError, KeyError):
+                return None
+            expires_at = time.time() + self.ttl
+            if data.get('exp'):
+                expires_at = min(expires_at, data['exp'])
+            with self._lock:
+                self._put(self._tokens, token, expires_at, user_id)
+        return self.user(user_id)
+
+    def user(self, user_id):
+        """Return ``{'id', 'username', 'is_admin'}`` for a user, or None if it does not exist."""
+        self._check_version()
+        with self._lock:
+            entry = self._get(self._users, user_id)
+        if entry is not None:
+            return entry[1]
+
+        user = self.db.query("SELECT id, username, is_admin FROM users WHERE id = ?", (user_id,), one=True)
+        with self._lock:
+            self._put(self._users, user_id, time.time() + self.ttl, user)
+        return user
+
+    def invalidate_user(self, user_id):
+        """Forget a user's cached record and every token issued to them."""
+        with self._lock:
+            self._users.pop(user_id, None)
+            for token in [token for token, (_, owner) in self._tokens.items() if owner == user_id]:
+                del self._tokens[token]
@@ -0,0 +1,155 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FRAGMENTED_PROTOCOLS = ('m3u8', 'm3u8_native', 'http_dash_segments', 'dash_frag_urls', 'ism', 'f4m')
+
+
+def uses_fragments(info):
+    """Whether any format yt-dlp selected is fetched as fragments (HLS, DASH, ...)."""
+    formats = info.get('requested_formats') or [info]
+    return any(f.get('fragments') or f.get('protocol') in FRAGMENTED_PROTOCOLS for f in formats)
+
+
+def create_bandwidth_schema(cursor):
+    """Create the table where worker processes report their running transfers."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bandwidth_workers (
+        worker TEXT PRIMARY KEY,
+        transfers INTEGER NOT NULL,
+        seen REAL NOT NULL
+    )
+    ''')
+
+
+class BandwidthGovernor:
+    """Splits a global download budget fairly between users and their jobs.
+
+    Every running transfer registers the ``params`` dict of its YoutubeDL
+    instance. yt-dlp's downloaders read ``ratelimit`` from that same dict on
+    every block, so rewriting it rebalances a transfer while it runs. The
+    budget is split evenly between users with active transfers, then evenly
+    between each user's transfers and, for fragmented formats, their fragment
+    threads, which each apply the limit on their own. A budget of 0 means
+    unlimited.
+
+    With a ``db``, the limits are shared by every process: ``save`` stores
+    them in the ``settings`` table and ``sync``, run from the job queue's
+    poll, applies the stored limits and this worker's share of the budget.
+    Each worker reports its running transfers in ``bandwidth_workers`` and
+    takes the part of the budget its transfers make up of all live workers'
+    transfers, so N workers together stay within one budget.
+    """
+
+    def __init__(self, total_rate=0, fragment_concurrency=1, db=None):
+        self._lock = threading.Lock()
+        self._jobs = {}  # download_id -> (user_id, params, fragmented)
+        self.total_rate = total_rate
+        self.fragment_concurrency = fragment_concurrency
+        self.share = 1.0  # Part of total_rate this process's transfers may use
+        self.db = db
+        self._reported = None  # (transfers, time) last written to bandwidth_workers
+
+    def attach(self, download_id, user_id, params, fragmented=False):
+        with self._lock:
+            params['concurrent_fragment_downloads'] = self.fragment_concurrency
+            self._jobs[download_id] = (user_id, params, fragmented)
+            self._rebalance()
+
+    def detach(self, download_id):
+        with self._lock:
+            if self._jobs.pop(download_id, None) is not None:
+                self._rebalance()
+
+    def configure(self, total_rate=None, fragment_concurrency=None, share=None):
+        """Change the limits; running transfers pick up the new rate immediately."""
+        with self._lock:
+            limits = (self.total_rate, self.fragment_concurrency)
+            if total_rate is not None:
+                self.total_rate = total_rate
+            if fragment_concurrency is not None:
+                # Fragmented downloads copy their options when they start, so
+                # this applies to formats that have not started downloading yet
+                self.fragment_concurrency = fragment_concurrency
+                for _, params, _ in self._jobs.values():
+                    params['concurrent_fragment_downloads'] = fragment_concurrency
+            if share is not None:
+                self.share = share
+            self._rebalance()
+            if (self.total_rate, self.fragment_concurrency) != limits:
+                logger.info(f"Bandwidth limit set to {self.total_rate or 'unlimited'} B/s, "
+                            f"{self.fragment_concurrency} fragments per download")
+
+    def save(self, total_rate=None, fragment_concurrency=None):
+        """Change the limits of every process sharing the database; this one applies them at once."""
+        self.load()
+        self.configure(total_rate, fragment_concurrency)
+        self.db.execute(
+            "INSERT INTO settings (name, value) VALUES ('bandwidth', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (json.dumps({'total_rate': self.total_rate, 'fragment_concurrency': self.fragment_concurrency}),)
+        )
+
+    def load(self):
+        """Apply the limits saved in the database, if any were."""
+        row = self.db.query("SELECT value FROM settings WHERE name = 'bandwidth'", one=True)
+        if row is not None:
+            settings = json.loads(row['value'])
+            self.configure(settings['total_rate'], settings['fragment_concurrency'])
+
+    def sync(self, worker, ttl):
+        """Report this worker's transfers, then apply the saved limits and its share of the budget.
+
+        Workers not seen for ``ttl`` seconds no longer count. A worker with no
+        transfers is given the share one would get, ready for its next job.
+        """
+        now = time.time()
+        with self._lock:
+            transfers = len(self._jobs)
+        if self._reported is None or self._reported[0] != transfers or now - self._reported[1] >= ttl / 3:
+            with self.db.transaction() as conn:
+                conn.execute(
+                    "INSERT INTO bandwidth_workers (worker, transfers, seen) VALUES (?, ?, ?) "
+                    "ON CONFLICT(worker) DO UPDATE SET transfers = excluded.transfers, seen = excluded.seen",
+                    (worker, transfers, now)
+                )
+                conn.execute("DELETE FROM bandwidth_workers WHERE seen < ?", (now - ttl,))
+            self._reported = (transfers, now)
+
+        others = self.db.query(
+            "SELECT COALESCE(SUM(transfers), 0) AS transfers FROM bandwidth_workers WHERE worker != ? AND seen >= ?",
+            (worker, now - ttl), one=True
+        )['transfers']
+        mine = max(transfers, 1)
+        self.load()
+        self.configure(share=mine / (mine + others))
+
+    def _rebalance(self):
+        # Caller must hold self._lock
+        per_user = {}
+        for user_id, _, _ in self._jobs.values():
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+
+        for user_id, params, fragmented in self._jobs.values():
+            if not self.total_rate:
+                params.pop('ratelimit', None)
+                continue
+            share = self.total_rate * self.share / len(per_user) / per_user[user_id]
+            streams = params['concurrent_fragment_downloads'] if fragmented else 1
+            params['ratelimit'] = max(int(share / streams), 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'total_rate': self.total_rate,
+                'worker_rate': int(self.total_rate * self.share),
+                'fragment_concurrency': self.fragment_concurrency,
+                'downloads': [
+                    {'id': download_id, 'user_id': user_id, 'ratelimit': params.get('ratelimit')}
+                    for download_id, (user_id, params, _) in self._jobs.items()
+                ],
+            }
+
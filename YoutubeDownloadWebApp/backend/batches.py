@@ -0,0 +1,215 @@
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class BatchFormatError(ValueError):
+    """An uploaded batch line could not be parsed."""
+
+
+def parse_entries(stream, content_type, max_entries):
+    """Read ``(url, target_path)`` pairs from an NDJSON or CSV upload.
+
+    NDJSON lines are objects with ``url`` and ``targetPath``; CSV rows are
+    ``url,targetPath`` with an optional header. The stream is read line by
+    line, so the upload is never held in memory twice.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if 'csv' in (content_type or ''):
+        rows = ((number, row) for number, row in enumerate(csv.reader(text), 1))
+    else:
+        rows = ((number, line) for number, line in enumerate(text, 1))
+
+    entries = []
+    for number, row in rows:
+        if isinstance(row, str):
+            if not row.strip():
+                continue
+            try:
+                item = json.loads(row)
+                url, target_path = item.get('url'), item.get('targetPath', item.get('target_path'))
+            except (ValueError, AttributeError):
+                raise BatchFormatError(f"Line {number}: expected a JSON object")
+        else:
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if number == 1 and row[0].strip().lower() == 'url':
+                continue
+            url, target_path = row[0].strip(), row[1].strip() if len(row) > 1 else None
+
+        if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+            raise BatchFormatError(f"Line {number}: missing or invalid url")
+        if not isinstance(target_path, str) or not target_path:
+            raise BatchFormatError(f"Line {number}: missing targetPath")
+        entries.append((url, target_path))
+        if len(entries) > max_entries:
+            raise BatchFormatError(f"A batch can have at most {max_entries} entries")
+
+    if not entries:
+        raise BatchFormatError("The batch is empty")
+    return entries
+
+
+def playlist_target(target_path):
+    """Target for one video of a playlist: a file name only fits a single video, so use its directory."""
+    if not target_path.endswith('.mp4'):
+        return target_path
+    return (os.path.dirname(target_path) or '.') + '/'
+
+
+class BatchIngestor:
+    """Expands uploaded batches into download jobs in the background.
+
+    ``create`` only records the batch and its raw entries, so the request
+    returns immediately. A background thread leases expanding batches, runs
+    each entry through ``expand(url)`` (which yields the video URLs behind a
+    playlist or channel, lazily) and inserts the resulting jobs as queued,
+    unleased rows in transactions of ``insert_size``, where the job queue
+    picks them up. Every chunk records how far expansion got in the same
+    transaction, so a batch interrupted by a restart resumes without
+    duplicating jobs.
+    """
+
+    def __init__(self, db, expand, owner, insert_size=500, max_jobs=50000, lease_ttl=60, poll_interval=2.0):
+        self.db = db
+        self.expand = expand
+        self.owner = owner
+        self.insert_size = insert_size
+        self.max_jobs = max_jobs
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name="batch-ingestor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def create(self, user_id, entries, priority=0):
+        batch_id = str(uuid.uuid4())
+        self.db.execute(
+            "INSERT INTO batches (id, user_id, status, priority, entries) VALUES (?, ?, 'expanding', ?, ?)",
+            (batch_id, user_id, priority, json.dumps(entries))
+        )
+        self._wakeup.set()
+        return batch_id
+
+    def status(self, batch_id, user_id=None):
+        """Return a batch's expansion state and the aggregate state of its jobs, or None."""
+        batch = self.db.query(
+            "SELECT id, user_id, status, priority, json_array_length(entries) AS entries, next_entry, "
+            "failed_entries, total, error, created_at, updated_at FROM batches WHERE id = ?",
+            (batch_id,), one=True
+        )
+        if batch is None or (user_id is not None and batch['user_id'] != user_id):
+            return None
+
+        counts = {}
+        progress = 0.0
+        for row in self.db.query(
+            "SELECT status, COUNT(*) AS count, "
+            "SUM(CASE WHEN status = 'completed' THEN 100 ELSE MAX(progress, 0) END) AS progress "
+            "FROM downloads WHERE batch_id = ? GROUP BY status",
+            (batch_id,)
+        ):
+            counts[row['status']] = row['count']
+            progress += row['progress'] or 0
+
+        batch['expanded_entries'] = batch.pop('next_entry')
+        batch['counts'] = counts
+        batch['progress'] = round(progress / batch['total'], 1) if batch['total'] else 0
+        return batch
+
+    def _claim(self):
+        now = time.time()
+        with self.db.transaction() as conn:
+            return conn.execute(
+                "UPDATE batches SET lease_owner = ?, lease_expires = ? "
+                "WHERE id = (SELECT id FROM batches WHERE status = 'expanding' "
+                "AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY created_at LIMIT 1) "
+                "RETURNING id, user_id, priority, entries, next_entry, entry_offset, total",
+                (self.owner, now + self.lease_ttl, now)
+            ).fetchone()
+
+    def _loop(self):
+        while True:
+            try:
+                batch = self._claim()
+                if batch is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+                self._expand(dict(batch))
+            except Exception as e:
+                logger.error("Batch ingestion error: %s", e)
+                time.sleep(self.poll_interval)
+
+    def _expand(self, batch):
+        entries = json.loads(batch['entries'])
+        total = batch['total']
+        failed = 0
+        error = None
+        logger.info("Expanding batch %s: %d entries from entry %d", batch['id'], len(entries), batch['next_entry'])
+
+        for index in range(batch['next_entry'], len(entries)):
+            url, target_path = entries[index]
+            skip = batch['entry_offset'] if index == batch['next_entry'] else 0
+            offset = skip
+            rows = []
+            try:
+                for position, video_url in enumerate(self.expand(url)):
+                    if position < skip:
+                        continue
+                    if total + len(rows) >= self.max_jobs:
+                        error = f"Stopped after {self.max_jobs} jobs"
+                        break
+                    target = target_path if video_url == url else playlist_target(target_path)
+                    rows.append((str(uuid.uuid4()), batch['user_id'], video_url, target, batch['priority'], batch['id']))
+                    if len(rows) >= self.insert_size:
+                        offset += len(rows)
+                        total += len(rows)
+                        self._insert(batch['id'], rows, index, offset, total)
+                        rows = []
+            except Exception as e:
+                logger.warning("Could not expand %s in batch %s: %s", url, batch['id'], e)
+                failed += 1
+                error = str(e)
+
+            total += len(rows)
+            self._insert(batch['id'], rows, index + 1, 0, total, failed)
+            failed = 0
+            if total >= self.max_jobs:
+                break
+
+        self.db.execute(
+            "UPDATE batches SET status = 'expanded', error = ?, lease_owner = NULL, lease_expires = NULL, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (error, batch['id'])
+        )
+        logger.info("Batch %s expanded into %d jobs", batch['id'], total)
+
+    def _insert(self, batch_id, rows, next_entry, entry_offset, total, failed=0):
+        # Jobs and the expansion checkpoint are committed together; the lease is renewed with them
+        with self.db.transaction() as conn:
+            if rows:
+                conn.executemany(
+                    "INSERT INTO downloads (id, user_id, url, target_path, status, priority, batch_id) "
+                    "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                    rows
+                )
+            conn.execute(
+                "UPDATE batches SET next_entry = ?, entry_offset = ?, total = ?, "
+                "failed_entries = failed_entries + ?, lease_expires = ?, updated_at = CURRENT_TIMESTAMP "
+                "WHERE id = ?",
+                (next_entry, entry_offset, total, failed, time.time() + self.lease_ttl, batch_id)
+            )
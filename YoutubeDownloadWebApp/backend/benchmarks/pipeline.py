@@ -0,0 +1,281 @@
+"""End-to-end benchmark of the download pipeline and the API, with no network.
+
+A local HTTP server serves synthetic media files that yt-dlp's generic
+extractor picks up as direct downloads. The app runs in a temporary
+directory with its own database, serving the API on an ephemeral port while
+pollers hammer the batch status endpoint. Results are printed as JSON:
+
+    cd backend
+    python benchmarks/pipeline.py --jobs 20 --size-mb 20 --pollers 8 > results.json
+
+Compare runs across configurations (``--workers``, ``--no-checksum``,
+``--rate``) or commits to catch regressions in the hot paths.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+class SampleRecorder:
+    """Stand-in for a metrics histogram that keeps every observation."""
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.samples = []
+
+    def observe(self, value, **labels):
+        self.samples.append(value)
+        if self.histogram is not None:
+            self.histogram.observe(value, **labels)
+
+    def summary(self):
+        return {
+            'count': len(self.samples),
+            'p50_ms': milliseconds(percentile(self.samples, 0.5)),
+            'p99_ms': milliseconds(percentile(self.samples, 0.99)),
+            'max_ms': milliseconds(max(self.samples, default=None)),
+        }
+
+
+def start_media_server(payload, rate):
+    """Serve ``payload`` as video/mp4 at any path, throttled to ``rate`` bytes/sec per connection."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _headers(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+
+        def do_HEAD(self):
+            self._headers()
+
+        def do_GET(self):
+            self._headers()
+            view = memoryview(payload)
+            chunk = 256 * 1024
+            started = time.monotonic()
+            try:
+                for offset in range(0, len(view), chunk):
+                    self.wfile.write(view[offset:offset + chunk])
+                    if rate:
+                        ahead = (offset + chunk) / rate - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def api_request(base_url, path, token=None, body=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, headers=headers)
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def poll_statuses(base_url, token, ids, stop, latencies, errors):
+    path = '/api/downloads/status?ids=' + ','.join(ids)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            api_request(base_url, path, token)
+            latencies.append(time.perf_counter() - started)
+        except Exception:
+            errors.append(1)
+        # The Dashboard's fallback polls every 2 seconds; pollers here run flat out
+        time.sleep(0.01)
+
+
+def run(args, workdir):
+    os.environ['VIDEO_DOWNLOADER_DATABASE'] = os.path.join(workdir, 'bench.db')
+    os.environ['VIDEO_DOWNLOADER_DOWNLOAD_DIR'] = os.path.join(workdir, 'downloads')
+    os.environ['VIDEO_DOWNLOADER_TARGET_DIR'] = args.target_dir or os.path.join(workdir, 'target')
+    sys.path.insert(0, BACKEND_DIR)
+
+    import app as downloader
+    from finalize import same_filesystem
+    from werkzeug.serving import make_server
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    downloader.FINALIZE_CHECKSUM = args.checksum
+    downloader.scheduler.max_workers = args.workers
+    downloader.scheduler.per_user_limit = args.workers
+
+    # Record every database write and every progress flush
+    db_writes = SampleRecorder(downloader.db_write_seconds)
+    downloader.db.write_histogram = db_writes
+    progress_updates = []
+    flushed_rows = []
+    store = downloader.progress_store
+    update, flush = store.update, store.flush
+
+    def counted_update(*args, **kwargs):
+        progress_updates.append(1)
+        return update(*args, **kwargs)
+
+    def counted_flush():
+        flushed_rows.append(flush())
+        return flushed_rows[-1]
+
+    store.update, store.flush = counted_update, counted_flush
+
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+    media = start_media_server(payload, args.rate)
+    media_url = f'http://127.0.0.1:{media.server_port}'
+
+    downloader.start_services('all')
+    api = make_server('127.0.0.1', 0, downloader.app, threaded=True)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{api.server_port}'
+
+    token = api_request(base_url, '/api/login', body={'username': 'admin', 'password': 'admin123'})['token']
+
+    # Distinct URLs so every job is a real transfer rather than a shared or library hit
+    urls = [f'{media_url}/video.mp4' if args.same_video else f'{media_url}/video-{i}.mp4'
+            for i in range(args.jobs)]
+    started = time.perf_counter()
+    ids = []
+    for i in range(0, len(urls), 5):
+        batch = urls[i:i + 5]
+        ids += api_request(base_url, '/api/downloads', token,
+                           {'urls': batch, 'targetPaths': [f'bench/{i + j}.mp4' for j in range(len(batch))]})['download_ids']
+
+    stop = threading.Event()
+    latencies, errors = [], []
+    pollers = [threading.Thread(target=poll_statuses, args=(base_url, token, ids[:100], stop, latencies, errors),
+                                daemon=True) for _ in range(args.pollers)]
+    for poller in pollers:
+        poller.start()
+
+    placeholders = ','.join('?' * len(ids))
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        rows = downloader.db.query(f"SELECT status FROM downloads WHERE id IN ({placeholders})", ids)
+        if all(row['status'] in downloader.TERMINAL_STATES for row in rows):
+            break
+        time.sleep(0.1)
+    wall = time.perf_counter() - started
+
+    stop.set()
+    for poller in pollers:
+        poller.join()
+    api.shutdown()
+    media.shutdown()
+
+    statuses = {}
+    for row in downloader.db.query(f"SELECT status FROM downloads WHERE id IN ({placeholders})", ids):
+        statuses[row['status']] = statuses.get(row['status'], 0) + 1
+
+    finalize_count, finalize_seconds = downloader.stage_seconds.totals(stage='finalize')
+    download_count, download_seconds = downloader.stage_seconds.totals(stage='download')
+    finalized_mb = finalize_count * len(payload) / 1024 / 1024
+
+    return {
+        'config': {
+            'jobs': args.jobs,
+            'size_mb': args.size_mb,
+            'workers': args.workers,
+            'pollers': args.pollers,
+            'rate': args.rate,
+            'checksum': args.checksum,
+            'same_video': args.same_video,
+            'cross_filesystem': not same_filesystem(downloader.STAGING_DIR, downloader.TARGET_DIR),
+        },
+        'jobs': {
+            'statuses': statuses,
+            'wall_seconds': round(wall, 3),
+            'jobs_per_minute': round(statuses.get('completed', 0) / wall * 60, 2),
+            'timed_out': time.monotonic() >= deadline,
+        },
+        'download': {
+            'count': download_count,
+            'mean_seconds': round(download_seconds / download_count, 3) if download_count else None,
+        },
+        'progress': {
+            'updates': len(progress_updates),
+            'updates_per_second': round(len(progress_updates) / wall, 1),
+            'flushes': sum(1 for rows in flushed_rows if rows),
+            'rows_flushed': sum(flushed_rows),
+        },
+        'finalize': {
+            'count': finalize_count,
+            'seconds': round(finalize_seconds, 3),
+            'mb_per_second': round(finalized_mb / finalize_seconds, 1) if finalize_seconds else None,
+        },
+        'api': {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'requests_per_second': round(len(latencies) / wall, 1),
+            'p50_ms': milliseconds(percentile(latencies, 0.5)),
+            'p99_ms': milliseconds(percentile(latencies, 0.99)),
+        },
+        # Write latency includes waiting for SQLite's write lock, so its tail shows contention
+        'sqlite_writes': db_writes.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--jobs', type=int, default=20, help='downloads to run')
+    parser.add_argument('--size-mb', type=int, default=20, help='size of each synthetic video')
+    parser.add_argument('--workers', type=int, default=4, help='download worker threads')
+    parser.add_argument('--pollers', type=int, default=8, help='concurrent status pollers')
+    parser.add_argument('--rate', type=int, default=0, help='bytes/sec per media connection, 0 for unthrottled')
+    parser.add_argument('--no-checksum', dest='checksum', action='store_false', help='finalize without SHA-256')
+    parser.add_argument('--target-dir', help='finalize into this directory, e.g. on another filesystem '
+                                            'to measure copy rather than rename throughput')
+    parser.add_argument('--same-video', action='store_true', help='request one URL for every job')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for the jobs to finish')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary work directory')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='downloader-bench-')
+    try:
+        # yt-dlp prints progress to stdout; keep stdout for the results
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run(args, workdir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import logging
+import os
+import signal
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job, including from its yt-dlp hooks, once it has been cancelled.
+
+    A plain exception rather than yt-dlp's DownloadCancelled, so importing
+    this module does not import yt-dlp; yt-dlp passes exceptions raised by
+    hooks through unchanged either way.
+    """
+
+    def __init__(self, msg='Download cancelled by user'):
+        super().__init__(msg)
+
+
+class CancellationRegistry:
+    """Cancellation flags for running downloads.
+
+    The cancel endpoint sets a job's flag; the job checks it from its yt-dlp
+    hooks and at every stage boundary and raises JobCancelled to unwind.
+    Callbacks registered with ``on_cancel`` run on the cancelling thread to
+    interrupt work that does not call any hook, such as an ffmpeg merge.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}
+        self._callbacks = {}
+
+    def register(self, download_id):
+        with self._lock:
+            return self._events.setdefault(download_id, threading.Event())
+
+    def unregister(self, download_id):
+        with self._lock:
+            self._events.pop(download_id, None)
+            self._callbacks.pop(download_id, None)
+
+    def on_cancel(self, download_id, callback):
+        with self._lock:
+            self._callbacks.setdefault(download_id, []).append(callback)
+
+    def cancel(self, download_id):
+        with self._lock:
+            event = self._events.setdefault(download_id, threading.Event())
+            callbacks = list(self._callbacks.get(download_id, []))
+        event.set()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Cancel callback for {download_id} failed: {str(e)}")
+
+    def is_cancelled(self, download_id):
+        with self._lock:
+            event = self._events.get(download_id)
+        return event is not None and event.is_set()
+
+    def check(self, download_id):
+        if self.is_cancelled(download_id):
+            raise JobCancelled()
+
+
+def terminate_children(path):
+    """SIGTERM child processes of this process whose command line mentions ``path``.
+
+    Used to stop the ffmpeg merge yt-dlp runs on files in a job's temp dir.
+    Linux only; elsewhere this is a no-op.
+    """
+    if not os.path.isdir('/proc'):
+        return 0
+
+    killed = 0
+    me = os.getpid()
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            if ppid != me:
+                continue
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read().decode(errors='replace')
+            if path in cmdline:
+                os.kill(int(pid), signal.SIGTERM)
+                killed += 1
+        except (OSError, ValueError, IndexError):
+            continue
+    if killed:
+        logger.info(f"Terminated {killed} child processes working in {path}")
+    return killed
@@ -0,0 +1,107 @@
+import logging
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """Pool of SQLite connections shared by the routes and download workers.
+
+    Connections are opened lazily, reused across requests and threads, and
+    configured for WAL so readers never block the writers recording progress.
+    Each connection keeps its own cache of compiled statements, which stays
+    warm because connections are not closed between requests.
+
+    If ``write_histogram`` is given, the duration of every ``execute`` and
+    ``executemany`` transaction (including waiting for the write lock) is
+    observed on it.
+    """
+
+    def __init__(self, path, pool_size=8, busy_timeout=5000, cached_statements=256, write_histogram=None):
+        self.path = path
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.write_histogram = write_histogram
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool; uncommitted work is rolled back on return."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and commit on success, roll back on error."""
+        with self.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def query(self, sql, params=(), one=False):
+        """Run a SELECT and return rows as dicts (or a single dict/None if ``one``)."""
+        with self.connection() as conn:
+            cursor = conn.execute(sql, params)
+            if one:
+                row = cursor.fetchone()
+                return dict(row) if row else None
+            return [dict(row) for row in cursor.fetchall()]
+
+    def execute(self, sql, params=()):
+        """Run a single write in its own transaction and return the cursor."""
+        start = time.perf_counter()
+        with self.transaction() as conn:
+            cursor = conn.execute(sql, params)
+        self._observe_write(start)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        """Run a batch of writes in one transaction and return the number of rows changed."""
+        start = time.perf_counter()
+        with self.transaction() as conn:
+            rowcount = conn.executemany(sql, seq_of_params).rowcount
+        self._observe_write(start)
+        return rowcount
+
+    def _observe_write(self, start):
+        if self.write_histogram is not None:
+            self.write_histogram.observe(time.perf_counter() - start)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,177 @@
+import copy
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+YOUTUBE_ID_RE = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:.*[?&]v=|embed/|shorts/|live/|v/)|youtu\.be/)([0-9A-Za-z_-]{11})'
+)
+
+
+def canonical_video_key(url):
+    """Return a cache key that is identical for every URL form of the same video."""
+    match = YOUTUBE_ID_RE.search(url)
+    if match:
+        return f"Youtube:{match.group(1)}"
+    return url.strip()
+
+
+def info_video_key(info):
+    return f"{info['extractor_key']}:{info['id']}"
+
+
+class InfoCache:
+    """TTL/LRU cache of yt-dlp extractor results keyed by canonical video ID.
+
+    Concurrent lookups for the same video wait for a single extraction
+    instead of each hitting the site.
+    """
+
+    def __init__(self, ttl=300, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, info)
+        self._key_locks = {}  # key -> [lock, lookups holding or waiting for it]
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _put(self, keys, info):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (expires_at, info)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_extract(self, url, extract):
+        """Return a private copy of the info for ``url``, calling ``extract(url)`` on a miss."""
+        key = canonical_video_key(url)
+        info = self._get(key)
+        if info is None:
+            with self._lock:
+                key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+                key_lock[1] += 1
+            try:
+                with key_lock[0]:
+                    info = self._get(key)
+                    if info is None:
+                        info = extract(url)
+                        self._put({key, info_video_key(info)}, info)
+                    else:
+                        logger.debug("Extractor info cache hit for %s", key)
+            finally:
+                # The last lookup drops the lock, whether the extraction succeeded or failed
+                with self._lock:
+                    key_lock[1] -= 1
+                    if not key_lock[1]:
+                        del self._key_locks[key]
+        else:
+            logger.debug("Extractor info cache hit for %s", key)
+        return copy.deepcopy(info)
+
+
+class DownloadFlight:
+    """One in-flight download shared by every job that asked for the same video."""
+
+    def __init__(self, key, leader, temp_dir):
+        self.key = key
+        self.leader = leader
+        self.temp_dir = temp_dir
+        self.participants = [leader]
+        self.filename = None
+        self.error = None
+        self._done = threading.Event()
+        self._refs = 1
+
+    @property
+    def shared(self):
+        return len(self.participants) > 1
+
+    def wait(self, check=None, interval=0.5):
+        """Block until the leader finishes; return its file or raise its error.
+
+        ``check`` is called every ``interval`` seconds while waiting and may raise
+        to stop waiting early.
+        """
+        while not self._done.wait(interval if check else None):
+            check()
+        if self.error is not None:
+            raise self.error
+        return self.filename
+
+
+class SingleFlight:
+    """Coalesce concurrent downloads of the same video into one transfer.
+
+    The first job for a key becomes the leader and downloads into its own temp
+    dir; later jobs join as followers and wait for the leader's file. Once the
+    leader resolves, the flight is closed to new joiners and each participant
+    finalizes its own copy. The last participant to release the flight gets the
+    temp dir back for cleanup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._held = set()  # flights some participant has not released yet
+
+    def temp_dirs(self):
+        """Temp dirs that participants of a flight may still read from."""
+        with self._lock:
+            return {flight.temp_dir for flight in self._held}
+
+    def join(self, key, download_id, temp_dir):
+        """Return ``(flight, is_leader)`` for a job that wants ``key``."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = DownloadFlight(key, download_id, temp_dir)
+                self._flights[key] = flight
+                self._held.add(flight)
+                return flight, True
+            flight.participants.append(download_id)
+            flight._refs += 1
+            logger.info("Download %s joined in-flight download of %s led by %s", download_id, key, flight.leader)
+            return flight, False
+
+    def resolve(self, flight, filename):
+        with self._lock:
+            self._flights.pop(flight.key, None)
+            flight.filename = filename
+        flight._done.set()
+
+    def fail(self, flight, error):
+        with self._lock:
+            self._flights.pop(flight.key, None)
+            flight.error = error
+        flight._done.set()
+
+    def release(self, flight, download_id):
+        """Drop one participant; return the temp dir to remove once the last one is done.
+
+        A job that leaves no longer counts as a participant, so a download
+        whose remaining jobs are all cancelled can still be aborted.
+        """
+        with self._lock:
+            if download_id in flight.participants:
+                flight.participants.remove(download_id)
+            flight._refs -= 1
+            if flight._refs == 0:
+                self._held.discard(flight)
+                return flight.temp_dir
+            return None
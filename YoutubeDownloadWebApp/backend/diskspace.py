@@ -0,0 +1,192 @@
+import errno
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientSpace(Exception):
+    """A volume has no room for a download yet; the job should wait and try again."""
+
+    def __init__(self, path, needed, available):
+        super().__init__(f"{path} needs {needed} bytes, {max(available, 0)} available below the watermark")
+        self.path = path
+        self.needed = needed
+        self.available = available
+
+
+def estimate_size(info):
+    """Expected size in bytes of the formats yt-dlp selected, or None if it reported nothing usable.
+
+    Uses ``filesize``, then ``filesize_approx``, then bitrate times duration,
+    summed over the separate formats of a merged download.
+    """
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size and fmt.get('tbr') and info.get('duration'):
+            size = fmt['tbr'] * 125 * info['duration']
+        if not size:
+            return None
+        total += size
+    return int(total)
+
+
+def directory_size(path):
+    """Return ``(bytes, newest mtime)`` of the files under ``path``."""
+    size = 0
+    newest = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += st.st_blocks * 512
+            newest = max(newest, st.st_mtime)
+    return size, newest
+
+
+class DiskSpaceGuard:
+    """Admission control for downloads by the free space on the volumes they write to.
+
+    Before a job writes anything it reserves the bytes it expects to need on
+    each volume. It is admitted only if the volume's usage, plus what every
+    other reservation on it has still to write, stays at or below
+    ``high_watermark`` (a fraction of the volume). Otherwise ``reserve``
+    raises ``InsufficientSpace`` and the job waits in the queue. Usage above
+    the high watermark also prunes stale temp directories under
+    ``temp_root``, oldest first, until it is back under ``low_watermark``.
+
+    ``is_stale(name, idle_seconds)`` decides whether the temp directory for
+    download ``name`` can be removed.
+    """
+
+    def __init__(self, temp_root, is_stale, high_watermark=0.9, low_watermark=0.8, check_interval=60):
+        self.temp_root = temp_root
+        self.is_stale = is_stale
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._reservations = {}  # download_id -> [(st_dev, bytes, written_dir)]
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name="disk-space")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _outstanding(self, device, exclude=None):
+        # Caller must hold self._lock; bytes reserved on device that are not on disk yet
+        total = 0
+        for download_id, needs in self._reservations.items():
+            if download_id == exclude:
+                continue
+            for dev, size, written_dir in needs:
+                if dev == device:
+                    written = directory_size(written_dir)[0] if written_dir and os.path.isdir(written_dir) else 0
+                    total += max(size - written, 0)
+        return total
+
+    def reserve(self, download_id, needs):
+        """Reserve space for a download; ``needs`` lists ``(path, bytes, written_dir)`` per volume.
+
+        ``written_dir`` is where the job writes the reserved bytes, if
+        anywhere, so they are not counted twice once they are on disk.
+        """
+        by_device = {}
+        for path, size, written_dir in needs:
+            device = os.stat(path).st_dev
+            entry = by_device.setdefault(device, [path, 0, written_dir])
+            entry[1] += size
+            entry[2] = entry[2] or written_dir
+
+        for attempt in range(2):
+            shortfall = None
+            with self._lock:
+                for device, (path, size, written_dir) in by_device.items():
+                    usage = shutil.disk_usage(path)
+                    limit = usage.total * self.high_watermark
+                    if size > limit:
+                        raise OSError(errno.EFBIG, f"Download of {size} bytes can never fit on {path}")
+                    already = directory_size(written_dir)[0] if written_dir and os.path.isdir(written_dir) else 0
+                    available = limit - usage.used - self._outstanding(device, download_id)
+                    if max(size - already, 0) > available:
+                        shortfall = InsufficientSpace(path, size - already, int(available))
+                        break
+                else:
+                    self._reservations[download_id] = [(device, size, written_dir)
+                                                       for device, (path, size, written_dir) in by_device.items()]
+                    return
+            # Only the temp volume has anything to prune
+            if (attempt > 0 or os.stat(shortfall.path).st_dev != os.stat(self.temp_root).st_dev
+                    or not self.prune(shortfall.needed - shortfall.available)):
+                break
+        raise shortfall
+
+    def release(self, download_id):
+        with self._lock:
+            self._reservations.pop(download_id, None)
+
+    def snapshot(self):
+        with self._lock:
+            reservations = {download_id: sum(size for _, size, _ in needs)
+                            for download_id, needs in self._reservations.items()}
+        usage = shutil.disk_usage(self.temp_root)
+        return {
+            'high_watermark': self.high_watermark,
+            'low_watermark': self.low_watermark,
+            'temp_used': usage.used,
+            'temp_total': usage.total,
+            'reservations': reservations,
+        }
+
+    def prune(self, needed=0):
+        """Remove stale temp directories until usage is under the low watermark and ``needed`` bytes are free.
+
+        Returns the number of bytes freed.
+        """
+        with self._prune_lock:
+            usage = shutil.disk_usage(self.temp_root)
+            target = max(usage.used - usage.total * self.low_watermark, needed)
+            if target <= 0:
+                return 0
+
+            now = time.time()
+            candidates = []
+            for name in os.listdir(self.temp_root):
+                path = os.path.join(self.temp_root, name)
+                if not os.path.isdir(path):
+                    continue
+                size, newest = directory_size(path)
+                idle = now - (newest or os.stat(path).st_mtime)
+                if self.is_stale(name, idle):
+                    candidates.append((-idle, path, size))
+
+            freed = 0
+            for _, path, size in sorted(candidates):
+                if freed >= target:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                freed += size
+                logger.info("Pruned stale temp directory %s (%d bytes)", path, size)
+            return freed
+
+    def _loop(self):
+        while True:
+            try:
+                usage = shutil.disk_usage(self.temp_root)
+                if usage.used > usage.total * self.high_watermark:
+                    logger.warning("Temp volume at %.0f%% of capacity, pruning stale temp directories",
+                                   usage.used / usage.total * 100)
+                    self.prune()
+            except Exception as e:
+                logger.error("Disk space check error: %s", e)
+            time.sleep(self.check_interval)
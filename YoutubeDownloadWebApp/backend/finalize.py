@@ -0,0 +1,139 @@
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+FICLONE = 0x40049409  # ioctl that shares extents on btrfs/XFS
+
+
+def same_filesystem(path_a, path_b):
+    """Return True if both existing paths live on the same device."""
+    return os.stat(path_a).st_dev == os.stat(path_b).st_dev
+
+
+def _link_or_reflink(src, tmp):
+    try:
+        os.link(src, tmp)
+        return 'Hardlinked'
+    except OSError as e:
+        if e.errno not in (errno.EMLINK, errno.EPERM, errno.EXDEV, errno.ENOTSUP):
+            raise
+
+    with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return 'Reflinked'
+        except OSError:
+            pass
+    os.remove(tmp)
+    return None
+
+
+def _kernel_copy(src_fd, dst_fd, size):
+    # Let the kernel move the bytes without passing them through userspace;
+    # copy_file_range can also reflink on filesystems that support it.
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(src_fd, dst_fd, size - copied)
+            if n == 0:
+                break
+            copied += n
+        return copied
+    except (AttributeError, OSError):
+        if copied:
+            raise
+
+    while copied < size:
+        n = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def _hashed_copy(src, dst, checksum):
+    buffer = bytearray(COPY_CHUNK_SIZE)
+    view = memoryview(buffer)
+    copied = 0
+    while True:
+        n = src.readinto(buffer)
+        if not n:
+            break
+        checksum.update(view[:n])
+        dst.write(view[:n])
+        copied += n
+    return copied
+
+
+def finalize_file(src, dst, checksum=True, keep_source=False):
+    """Move a finished download to its final path.
+
+    On the same filesystem this is a single atomic ``os.replace``, or a hardlink
+    (falling back to a reflink) with ``keep_source``. Otherwise the file is copied to a temporary name next
+    to ``dst`` and renamed into place, either through a kernel-side copy or,
+    when ``checksum`` is set, in one streaming pass that also computes its
+    SHA-256. With ``keep_source`` the source is left untouched.
+
+    Returns ``(size, sha256)``; ``sha256`` is None when no bytes were copied or
+    checksums are disabled. Raises OSError if the copy comes up short.
+    """
+    size = os.path.getsize(src)
+    dst_dir = os.path.dirname(dst)
+
+    tmp = os.path.join(dst_dir, f".{os.path.basename(dst)}.{os.getpid()}.{threading.get_ident()}.part")
+
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return size, None
+
+    if same_filesystem(src, dst_dir):
+        if not keep_source:
+            os.replace(src, dst)
+            logger.info("Renamed %s -> %s", src, dst)
+            return size, None
+
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        method = _link_or_reflink(src, tmp)
+        if method:
+            os.replace(tmp, dst)
+            logger.info("%s %s -> %s", method, src, dst)
+            return size, None
+
+    digest = hashlib.sha256() if checksum else None
+    try:
+        with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            if digest:
+                copied = _hashed_copy(fsrc, fdst, digest)
+                fdst.flush()
+            else:
+                try:
+                    copied = _kernel_copy(fsrc.fileno(), fdst.fileno(), size)
+                except OSError:
+                    fdst.seek(0)
+                    fdst.truncate()
+                    shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+                    copied = fdst.tell()
+            os.fsync(fdst.fileno())
+
+        if copied != size:
+            raise OSError(f"Short copy of {src}: {copied} of {size} bytes")
+
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if not keep_source:
+        os.remove(src)
+
+    logger.info("Copied %s -> %s (%d bytes)", src, dst, size)
+    return size, digest.hexdigest() if digest else None
@@ -0,0 +1,192 @@
+import math
+import re
+
+# Fields of a format policy as the API and the database store them
+POLICY_FIELDS = ('maxHeight', 'preferProgressive', 'audioOnly', 'videoCodecs', 'audioCodecs')
+MAX_CODECS = 8
+
+_CODEC = re.compile(r'^[a-z0-9.]+$')
+
+
+class FormatPolicyError(ValueError):
+    """A format policy has an unknown field or an invalid value."""
+
+
+def parse_policy(data):
+    """Validate a policy, or part of one, as sent to the API; return it with the fields it sets."""
+    if not isinstance(data, dict):
+        raise FormatPolicyError("formatPolicy must be an object")
+    unknown = set(data) - set(POLICY_FIELDS)
+    if unknown:
+        raise FormatPolicyError(f"Unknown format policy fields: {', '.join(sorted(unknown))}")
+
+    policy = {}
+    for field, value in data.items():
+        if value is None:
+            continue
+        if field == 'maxHeight':
+            if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                raise FormatPolicyError("maxHeight must be a positive integer")
+        elif field in ('preferProgressive', 'audioOnly'):
+            if not isinstance(value, bool):
+                raise FormatPolicyError(f"{field} must be true or false")
+        else:
+            if (not isinstance(value, list) or len(value) > MAX_CODECS
+                    or not all(isinstance(codec, str) and _CODEC.match(codec.lower()) for codec in value)):
+                raise FormatPolicyError(f"{field} must be a list of at most {MAX_CODECS} codec names, "
+                                        f"e.g. [\"avc1\", \"vp9\"]")
+            value = [codec.lower() for codec in value]
+        policy[field] = value
+    return policy
+
+
+def _has_video(fmt):
+    # yt-dlp marks a missing stream 'none'; an unknown codec may still be there
+    return fmt.get('vcodec') != 'none'
+
+
+def _has_audio(fmt):
+    return fmt.get('acodec') != 'none'
+
+
+def _rank(codec, preferences):
+    # Position of the first preference the codec starts with; unlisted codecs come last
+    codec = codec or ''
+    return next((i for i, preferred in enumerate(preferences) if codec.startswith(preferred)), len(preferences))
+
+
+def _size(fmt, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        size = fmt['tbr'] * 125 * duration
+    return size or math.inf
+
+
+class FormatPolicy:
+    """Which formats of a video a download fetches.
+
+    ``max_height`` caps the resolution, ``audio_only`` fetches sound alone,
+    ``prefer_progressive`` takes a single file with video and audio over
+    separate streams whenever one exists at the chosen resolution, and
+    ``video_codecs``/``audio_codecs`` list codec prefixes in order of
+    preference.
+
+    ``select`` picks from the formats yt-dlp extracted: the highest
+    resolution the policy allows, then the preferred codec, then the fewest
+    bytes, so a progressive file that is no larger than the separate streams
+    also saves the ffmpeg merge.
+    """
+
+    def __init__(self, max_height=None, prefer_progressive=False, audio_only=False,
+                 video_codecs=(), audio_codecs=()):
+        self.max_height = max_height
+        self.prefer_progressive = prefer_progressive
+        self.audio_only = audio_only
+        self.video_codecs = tuple(video_codecs)
+        self.audio_codecs = tuple(audio_codecs)
+
+    @classmethod
+    def from_layers(cls, *layers):
+        """Build a policy from API-style dicts; fields set in later layers win."""
+        merged = {}
+        for layer in layers:
+            if layer:
+                merged.update(parse_policy(layer))
+        return cls(merged.get('maxHeight'), merged.get('preferProgressive', False), merged.get('audioOnly', False),
+                   merged.get('videoCodecs', ()), merged.get('audioCodecs', ()))
+
+    def to_dict(self):
+        return {
+            'maxHeight': self.max_height,
+            'preferProgressive': self.prefer_progressive,
+            'audioOnly': self.audio_only,
+            'videoCodecs': list(self.video_codecs),
+            'audioCodecs': list(self.audio_codecs),
+        }
+
+    @property
+    def key(self):
+        """Short stable name of the policy, which the library files downloads under."""
+        parts = []
+        if self.audio_only:
+            parts.append('audio')
+        else:
+            if self.max_height:
+                parts.append(f'h<={self.max_height}')
+            if self.prefer_progressive:
+                parts.append('progressive')
+            if self.video_codecs:
+                parts.append('v=' + ','.join(self.video_codecs))
+        if self.audio_codecs:
+            parts.append('a=' + ','.join(self.audio_codecs))
+        return ';'.join(parts) or 'best'
+
+    def fallback_spec(self):
+        """yt-dlp format spec for the policy, used when the extracted formats cannot be compared."""
+        if self.audio_only:
+            return 'bestaudio/best'
+        height = f'[height<=?{self.max_height}]' if self.max_height else ''
+        merged, single = f'bv*{height}+ba', f'b{height}'
+        return f'{single}/{merged}' if self.prefer_progressive else f'{merged}/{single}'
+
+    def _best_audio(self, formats):
+        audio = [fmt for fmt in formats if _has_audio(fmt) and not _has_video(fmt)]
+        return min(audio, key=lambda fmt: (_rank(fmt.get('acodec'), self.audio_codecs),
+                                           -(fmt.get('abr') or fmt.get('tbr') or 0)), default=None)
+
+    def select(self, info):
+        """The formats to download for the extracted ``info``, or None to fall back to ``fallback_spec``."""
+        formats = [fmt for fmt in info.get('formats') or () if fmt.get('format_id')]
+        duration = info.get('duration')
+        if self.audio_only:
+            audio = self._best_audio(formats)
+            return [audio] if audio else None
+
+        video = [fmt for fmt in formats if _has_video(fmt)]
+        allowed = [fmt for fmt in video if not self.max_height or (fmt.get('height') or 0) <= self.max_height]
+        if not allowed:
+            # Nothing is small enough: take the lowest resolution there is
+            lowest = min((fmt.get('height') or 0 for fmt in video), default=None)
+            allowed = [fmt for fmt in video if (fmt.get('height') or 0) == lowest]
+        if not allowed:
+            return None
+        height = max(fmt.get('height') or 0 for fmt in allowed)
+
+        audio = self._best_audio(formats)
+        options = []
+        for fmt in allowed:
+            if (fmt.get('height') or 0) != height:
+                continue
+            if _has_audio(fmt):
+                options.append([fmt])
+            elif audio is not None:
+                options.append([fmt, audio])
+        if not options:
+            return None
+
+        return min(options, key=lambda option: (
+            self.prefer_progressive and len(option) > 1,
+            _rank(option[0].get('vcodec'), self.video_codecs),
+            # Progressive files keep their container, so an mp4 one is preferred
+            len(option) == 1 and option[0].get('ext') != 'mp4',
+            sum(_size(fmt, duration) for fmt in option),
+            len(option),
+        ))
+
+
+def format_spec(formats):
+    """yt-dlp format spec that downloads exactly ``formats``."""
+    return '+'.join(fmt['format_id'] for fmt in formats)
+
+
+def selected_info(info, formats):
+    """Copy of ``info`` with ``formats`` as its selection, listed in ``requested_formats``.
+
+    The fields yt-dlp copied from the formats it chose itself are dropped,
+    so size estimates and media metadata describe the policy's choice.
+    """
+    format_fields = set().union(*(fmt.keys() for fmt in info.get('formats') or ()))
+    selected = {key: value for key, value in info.items() if key not in format_fields or key == 'formats'}
+    selected['requested_formats'] = formats
+    selected['format_id'] = format_spec(formats)
+    return selected
@@ -0,0 +1,9 @@
+# Settings gunicorn reads when started from this directory, e.g.
+#   gunicorn wsgi:app
+# Each open /api/downloads/stream holds a thread for as long as the dashboard
+# is open, so the web tier uses threaded workers: a sync worker would be
+# taken by one stream and killed by the worker timeout.
+bind = '0.0.0.0:4000'
+workers = 4
+worker_class = 'gthread'
+threads = 32  # Per worker; bounds the streams and requests it serves at once
@@ -0,0 +1,203 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+from progress import ACTIVE_STATES
+
+logger = logging.getLogger(__name__)
+
+# The states as SQL literals: queries must spell them out to use the partial index
+# idx_downloads_queue, which create_queue_index builds over the same states
+QUEUE_STATES = ','.join(f"'{state}'" for state in ACTIVE_STATES)
+
+
+def create_queue_index(cursor):
+    """Index the rows a worker can claim, per user in claim order; finished history is left out."""
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_downloads_queue "
+                   f"ON downloads (user_id, priority DESC, created_at) WHERE status IN ({QUEUE_STATES})")
+
+
+class JobQueue:
+    """Lease-based job queue on top of the ``downloads`` table.
+
+    Any number of worker processes can share one database. A worker claims
+    queued rows by stamping them with its ``lease_owner`` and a
+    ``lease_expires`` time, and keeps renewing the lease while it holds the
+    job. If a worker dies its leases run out and another worker claims the
+    rows again, which also requeues downloads interrupted mid-transfer.
+    Every poll also checks the jobs a worker holds, which is how it learns
+    that one was cancelled through the web tier.
+
+    ``submit(row)`` hands a claimed row to the local scheduler and
+    ``cancel(download_id)`` stops a local job that was cancelled or lost.
+    Jobs that have moved on from the scheduler to the post-processing pool
+    ``processing`` keep their leases but no longer occupy a download worker.
+    With a ``bandwidth`` governor, every poll also syncs its limits and this
+    worker's share of the budget with the other workers.
+    """
+
+    def __init__(self, db, scheduler, submit, cancel, lease_ttl=30, poll_interval=1.0, processing=None,
+                 bandwidth=None):
+        self.db = db
+        self.scheduler = scheduler
+        self.processing = processing
+        self.bandwidth = bandwidth
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._submit = submit
+        self._cancel = cancel
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread:
+            return
+        self.recover_local()
+        self._thread = threading.Thread(target=self._loop, name="job-queue")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Job queue started as {self.owner}")
+
+    def new_lease(self):
+        """Lease columns for a row this process inserts and runs itself."""
+        return self.owner, time.time() + self.lease_ttl
+
+    def recover_local(self):
+        """Expire leases held by dead processes on this host so restarts do not wait out the TTL."""
+        host = socket.gethostname()
+        owners = self.db.query(
+            f"SELECT DISTINCT lease_owner FROM downloads "
+            f"WHERE status IN ({','.join('?' * len(ACTIVE_STATES))}) AND lease_owner LIKE ?",
+            (*ACTIVE_STATES, f"{host}:%")
+        )
+        for row in owners:
+            pid = row['lease_owner'].rsplit(':', 1)[1]
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except OSError:
+                # Alive but owned by another user
+                continue
+            released = self.db.execute(
+                f"UPDATE downloads SET lease_expires = NULL "
+                f"WHERE lease_owner = ? AND status IN ({','.join('?' * len(ACTIVE_STATES))})",
+                (row['lease_owner'], *ACTIVE_STATES)
+            ).rowcount
+            logger.info(f"Released {released} downloads leased by stopped worker {row['lease_owner']}")
+
+    def claim(self, limit):
+        """Lease up to ``limit`` unowned or abandoned downloads, highest priority first.
+
+        Within a priority, users take turns (each user's oldest job, then
+        their second oldest, ...), so a large batch from one user does not
+        hold back everyone queued behind it.
+
+        The order is worked out before the write transaction, from at most
+        ``limit`` rows per user read through ``idx_downloads_queue``, so the
+        database stays locked only for the update of the chosen rows. Rows
+        another worker takes in between fail the update's own check and are
+        left out of this claim.
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        candidates = []
+        users = self.db.query(f"SELECT DISTINCT user_id FROM downloads WHERE status IN ({QUEUE_STATES})")
+        for user in users:
+            candidates.extend(self.db.query(
+                f"SELECT id, user_id, priority, created_at, rowid AS seq FROM downloads "
+                f"WHERE user_id = ? AND status IN ({QUEUE_STATES}) "
+                f"AND (lease_expires IS NULL OR lease_expires < ?) "
+                f"ORDER BY priority DESC, created_at, rowid LIMIT ?",
+                (user['user_id'], now, limit)
+            ))
+        if not candidates:
+            return []
+
+        # Each user's rows arrive in their own order, so counting them gives the turns
+        turns = {}
+        for row in candidates:
+            group = (row['user_id'], row['priority'])
+            turns[group] = turns.get(group, 0) + 1
+            row['turn'] = turns[group]
+        candidates.sort(key=lambda row: (-row['priority'], row['turn'], row['created_at'] or '', row['seq']))
+        chosen = [row['id'] for row in candidates[:limit]]
+
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                f"UPDATE downloads SET status = 'queued', lease_owner = ?, lease_expires = ? "
+                f"WHERE id IN ({','.join('?' * len(chosen))}) AND status IN ({QUEUE_STATES}) "
+                f"AND (lease_expires IS NULL OR lease_expires < ?) "
+                f"RETURNING id, user_id, url, target_path, priority",
+                (self.owner, now + self.lease_ttl, *chosen, now)
+            ).fetchall()
+        rows = [dict(row) for row in rows]
+        if rows:
+            logger.info("Claimed %d downloads", len(rows))
+        return rows
+
+    def requeue(self, download_id, delay=0):
+        """Give up a held download so that any worker claims it again after ``delay`` seconds."""
+        self.db.execute(
+            "UPDATE downloads SET status = 'queued', lease_expires = ? WHERE id = ? AND lease_owner = ?",
+            (time.time() + delay, download_id, self.owner)
+        )
+
+    def check_held(self, renew=False):
+        """Stop local jobs that were cancelled or taken over elsewhere, optionally renewing the leases of the rest."""
+        held = set(self.scheduler.jobs)
+        if self.processing is not None:
+            held.update(self.processing.jobs)
+        held = list(held)
+        if not held:
+            return
+        placeholders = ','.join('?' * len(held))
+        with self.db.transaction() as conn:
+            if renew:
+                conn.execute(
+                    f"UPDATE downloads SET lease_expires = ? WHERE lease_owner = ? AND id IN ({placeholders})",
+                    (time.time() + self.lease_ttl, self.owner, *held)
+                )
+            rows = conn.execute(
+                f"SELECT id, status, lease_owner FROM downloads WHERE id IN ({placeholders})", held
+            ).fetchall()
+
+        for row in rows:
+            if row['status'] == 'cancelled':
+                self._cancel(row['id'])
+            elif row['lease_owner'] != self.owner and row['status'] in ACTIVE_STATES:
+                logger.warning(f"Lease on {row['id']} was taken over by {row['lease_owner']}")
+                self._cancel(row['id'])
+
+    def _idle_workers(self):
+        # Jobs waiting out a retry backoff do not occupy a worker; jobs waiting for
+        # a resource such as disk space do, so the worker stops claiming more
+        busy = sum(1 for job in list(self.scheduler.jobs.values())
+                   if not job['not_before'] or job['waiting_for'] != 'retry')
+        return self.scheduler.max_workers - busy
+
+    def _loop(self):
+        last_renewal = 0
+        while True:
+            try:
+                for row in self.claim(self._idle_workers()):
+                    self._submit(row)
+                renew = time.monotonic() - last_renewal >= self.lease_ttl / 3
+                self.check_held(renew)
+                if renew:
+                    last_renewal = time.monotonic()
+                if self.bandwidth is not None:
+                    self.bandwidth.sync(self.owner, self.lease_ttl)
+            except Exception as e:
+                logger.error(f"Job queue error: {str(e)}")
+            time.sleep(self.poll_interval)
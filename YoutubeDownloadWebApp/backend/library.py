@@ -0,0 +1,99 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+XATTR_VIDEO_KEY = 'user.ytdl.video_key'
+XATTR_FORMAT_KEY = 'user.ytdl.format_key'
+XATTR_SHA256 = 'user.ytdl.sha256'
+
+
+class LibraryIndex:
+    """Index of finished downloads under the target directory.
+
+    Maps a video key and format to the stored file so repeat requests can be
+    served from disk. Entries are validated against ``os.stat`` on lookup and
+    dropped if the file was moved, deleted or rewritten. The keys are also
+    written to the file's extended attributes so the index can be rebuilt by
+    scanning the directory.
+    """
+
+    def __init__(self, db, root):
+        self.db = db
+        self.root = root
+
+    def lookup(self, video_key, format_key):
+        entry = self.db.query(
+            "SELECT * FROM library WHERE video_key = ? AND format_key = ?",
+            (video_key, format_key), one=True
+        )
+        if entry is None:
+            return None
+
+        try:
+            st = os.stat(entry['path'])
+            fresh = st.st_size == entry['size'] and st.st_mtime == entry['mtime']
+        except OSError:
+            fresh = False
+
+        if not fresh:
+            logger.info("Dropping stale library entry for %s: %s", video_key, entry['path'])
+            self.db.execute(
+                "DELETE FROM library WHERE video_key = ? AND format_key = ? AND path = ?",
+                (video_key, format_key, entry['path'])
+            )
+            return None
+
+        return entry
+
+    def record(self, video_keys, format_key, path, checksum=None):
+        st = os.stat(path)
+        self.db.executemany(
+            "INSERT OR REPLACE INTO library (video_key, format_key, path, size, mtime, checksum) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(video_key, format_key, path, st.st_size, st.st_mtime, checksum) for video_key in video_keys]
+        )
+
+        # Best effort: not every filesystem supports user xattrs
+        try:
+            os.setxattr(path, XATTR_VIDEO_KEY, '\n'.join(video_keys).encode())
+            os.setxattr(path, XATTR_FORMAT_KEY, format_key.encode())
+            if checksum:
+                os.setxattr(path, XATTR_SHA256, checksum.encode())
+        except OSError as e:
+            logger.debug("Could not tag %s with library attributes: %s", path, e)
+
+    def rebuild(self):
+        """Replace the index with the tagged files found under the root directory."""
+        rows = []
+        scanned = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                scanned += 1
+                try:
+                    video_keys = os.getxattr(path, XATTR_VIDEO_KEY).decode().split('\n')
+                    format_key = os.getxattr(path, XATTR_FORMAT_KEY).decode()
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                try:
+                    checksum = os.getxattr(path, XATTR_SHA256).decode()
+                except OSError:
+                    checksum = None
+                for video_key in video_keys:
+                    rows.append((video_key, format_key, path, st.st_size, st.st_mtime, checksum))
+
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM library")
+            conn.executemany(
+                "INSERT OR REPLACE INTO library (video_key, format_key, path, size, mtime, checksum) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+        logger.info(f"Library index rebuilt: {len(rows)} entries from {scanned} files")
+        return {'scanned': scanned, 'indexed': len(rows)}
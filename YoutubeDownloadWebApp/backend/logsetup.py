@@ -0,0 +1,97 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+# Download the current thread is working on, attached to every record it logs
+current_download = contextvars.ContextVar('current_download', default=None)
+
+
+class DownloadContextFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'download_id'):
+            record.download_id = current_download.get()
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stock handler merges the arguments into the message before queueing.
+    Records stay in-process here, so that work can move off the caller; the
+    arguments must not be mutated after they are logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with time, level, logger, message and download_id."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'download_id', None):
+            entry['download_id'] = record.download_id
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimiter:
+    """Allows one event per key every ``interval`` seconds, e.g. progress log lines per download."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, float('-inf')) < self.interval:
+                return False
+            self._last[key] = now
+            return True
+
+    def forget(self, key):
+        with self._lock:
+            self._last.pop(key, None)
+
+
+def configure_logging(level=logging.INFO, json_format=True):
+    """Route all logging through a queue so callers never block on the output stream.
+
+    Records are put on an unbounded queue by a ``QueueHandler``; a
+    ``QueueListener`` thread formats and writes them. Messages should use
+    lazy ``%`` arguments, which are only formatted when a record passes the
+    level check, and then on the listener thread.
+    """
+    stream = logging.StreamHandler()
+    if json_format:
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(download_id)s] %(message)s'))
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(DownloadContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
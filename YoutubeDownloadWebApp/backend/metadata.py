@@ -0,0 +1,78 @@
+import json
+import logging
+import math
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def aspect_ratio(width, height):
+    """Return a simplified "W:H" ratio, or "Unknown" without usable dimensions."""
+    if not width or not height:
+        return "Unknown"
+    gcd = math.gcd(int(width), int(height))
+    return f"{int(width) // gcd}:{int(height) // gcd}"
+
+
+def _metadata(width, height, duration, vcodec, acodec, bitrate):
+    return {
+        'aspect_ratio': aspect_ratio(width, height),
+        'resolution': f"{int(width)}x{int(height)}" if width and height else None,
+        'duration': float(duration) if duration else None,
+        'vcodec': vcodec,
+        'acodec': acodec,
+        'bitrate': round(float(bitrate), 1) if bitrate else None,
+    }
+
+
+def info_metadata(info):
+    """Media metadata for the formats yt-dlp selected, or None if it lacks dimensions.
+
+    Merged downloads list their video and audio formats in ``requested_formats``.
+    Bitrate is in kbit/s.
+    """
+    formats = info.get('requested_formats') or [info]
+    video = next((f for f in formats if f.get('vcodec') not in (None, 'none')), formats[0])
+    audio = next((f for f in formats if f.get('acodec') not in (None, 'none')), None)
+
+    width = video.get('width') or info.get('width')
+    height = video.get('height') or info.get('height')
+    if not width or not height:
+        return None
+
+    bitrate = info.get('tbr') or sum(f.get('tbr') or 0 for f in formats)
+    return _metadata(width, height, info.get('duration'),
+                     video.get('vcodec') if video.get('vcodec') != 'none' else None,
+                     audio.get('acodec') if audio else None,
+                     bitrate)
+
+
+class MediaProbe:
+    """ffprobe fallback run on a small bounded pool so probes cannot pile up."""
+
+    def __init__(self, max_workers=2, timeout=30):
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ffprobe')
+
+    def probe(self, filename):
+        return self._pool.submit(self._run, filename).result()
+
+    def _run(self, filename):
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries',
+             'stream=codec_type,codec_name,width,height:format=duration,bit_rate', '-of', 'json', filename],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=self.timeout
+        )
+        data = json.loads(result.stdout or '{}')
+        streams = data.get('streams', [])
+        video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+        audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+        fmt = data.get('format', {})
+        bit_rate = fmt.get('bit_rate')
+        return _metadata(video.get('width'), video.get('height'), fmt.get('duration'),
+                         video.get('codec_name'), audio.get('codec_name'),
+                         int(bit_rate) / 1000 if bit_rate else None)
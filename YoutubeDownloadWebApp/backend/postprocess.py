@@ -0,0 +1,58 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class PostProcessingPool:
+    """Worker pool for the CPU and disk bound end of a download.
+
+    Download workers hand a job over once its data is on disk and go back to
+    the network, so merges, probes, checksums and copies to the target volume
+    of finished transfers run alongside the next transfers. ffmpeg runs as a
+    subprocess and hashing and copying release the GIL, so threads are enough;
+    the pool is sized to the CPU cores.
+
+    ``jobs`` holds every queued or running job by download ID.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="postprocess")
+        self._lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, download_id, func, *args):
+        job = {
+            'id': download_id,
+            'state': 'queued',
+            'queued_at': time.time(),
+            'started_at': None,
+        }
+        with self._lock:
+            self.jobs[download_id] = job
+        self._executor.submit(self._run, job, func, args)
+
+    def _run(self, job, func, args):
+        job['state'] = 'running'
+        job['started_at'] = time.time()
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"Unhandled error in post-processing for {job['id']}: {str(e)}")
+        finally:
+            with self._lock:
+                self.jobs.pop(job['id'], None)
+
+    def snapshot(self):
+        with self._lock:
+            jobs = [dict(job) for job in self.jobs.values()]
+        jobs.sort(key=lambda job: job['queued_at'])
+        return {
+            'max_workers': self.max_workers,
+            'running': sum(1 for job in jobs if job['state'] == 'running'),
+            'queued': sum(1 for job in jobs if job['state'] == 'queued'),
+            'jobs': jobs,
+        }
@@ -0,0 +1,210 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ('completed', 'failed', 'cancelled')
+RUNNING_STATES = ('downloading', 'processing', 'moving')
+ACTIVE_STATES = ('queued',) + RUNNING_STATES
+
+
+class ProgressStore:
+    """In-memory status/progress table for running downloads.
+
+    yt-dlp progress hooks write here instead of SQLite. A background flusher
+    persists the rows that changed since the last flush in one ``executemany``
+    every ``flush_interval`` seconds. Terminal states are written through
+    immediately and the row is dropped from memory, so the database stays the
+    source of truth for finished downloads.
+
+    In a web process without download workers the store runs as a mirror
+    instead: the background thread reloads the running rows the workers flush
+    to the database, so the status endpoints and streams work unchanged.
+    Queued rows are left out, as their state only changes when a worker
+    claims them: the reload reads the few running rows through the status
+    index however long the queue grows.
+    """
+
+    def __init__(self, db, flush_interval=1.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
+        self._entries = {}   # download_id -> live row
+        self._cached = set()  # download_ids whose full row has been cached
+        self._dirty = set()
+        self._flusher = None
+        self._mirror = False
+        self._stop = threading.Event()
+
+    def start(self, mirror=False):
+        if self._flusher:
+            return
+        self._mirror = mirror
+        self._flusher = threading.Thread(target=self._flush_loop,
+                                         name="progress-mirror" if mirror else "progress-flusher")
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join()
+            self._flusher = None
+        if not self._mirror:
+            self.flush()
+
+    def update(self, download_id, status, progress=0, fields=None):
+        """Record a status change; ``fields`` are extra columns written with a terminal state."""
+        if status in TERMINAL_STATES:
+            fields = fields or {}
+            assignments = ''.join(f", {column} = ?" for column in fields)
+            self.db.execute(
+                f"UPDATE downloads SET status = ?, progress = ?, updated_at = CURRENT_TIMESTAMP{assignments} WHERE id = ?",
+                (status, progress, *fields.values(), download_id)
+            )
+            self.discard(download_id)
+            return
+
+        with self._lock:
+            entry = self._entries.setdefault(download_id, {'id': download_id})
+            entry['status'] = status
+            entry['progress'] = progress
+            entry['updated_at'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+            self._dirty.add(download_id)
+            self._notify()
+
+    def register(self, download_id, user_id):
+        """Start tracking a queued download so its owner can be notified of changes."""
+        with self._lock:
+            entry = self._entries.setdefault(download_id, {'id': download_id, 'status': 'queued', 'progress': 0,
+                                                           'updated_at': None})
+            entry['user_id'] = user_id
+            self._notify()
+
+    def discard(self, download_id):
+        """Forget a download whose final state was written to the database elsewhere."""
+        with self._lock:
+            self._entries.pop(download_id, None)
+            self._cached.discard(download_id)
+            self._dirty.discard(download_id)
+            self._notify()
+
+    def get(self, download_id):
+        """Return the live row for a download, or None if it has to be read from the database."""
+        with self._lock:
+            if download_id not in self._cached:
+                return None
+            return dict(self._entries[download_id])
+
+    def snapshot(self, user_id):
+        """Return the live status of every tracked download owned by a user."""
+        with self._lock:
+            return {
+                download_id: {'status': entry['status'], 'progress': entry['progress']}
+                for download_id, entry in self._entries.items() if entry.get('user_id') == user_id
+            }
+
+    def wait(self, version, timeout=None):
+        """Block until the store changes after ``version`` (or the timeout expires); return the new version."""
+        with self._changed:
+            if self._version == version:
+                self._changed.wait(timeout)
+            return self._version
+
+    def _notify(self):
+        # Caller must hold self._lock
+        self._version += 1
+        self._changed.notify_all()
+
+    def track(self, row):
+        """Cache the database row of a running download so later reads skip SQLite."""
+        with self._lock:
+            entry = self._entries.get(row['id'])
+            if entry is None:
+                return
+            for key, value in row.items():
+                if key not in ('status', 'progress', 'updated_at'):
+                    entry[key] = value
+            # A download registered as queued has no live timestamp until its first update
+            entry['updated_at'] = entry.get('updated_at') or row.get('updated_at')
+            self._cached.add(row['id'])
+
+    def overlay(self, rows):
+        """Replace status and progress in database rows with their live values."""
+        with self._lock:
+            for row in rows:
+                entry = self._entries.get(row['id'])
+                if entry is not None:
+                    row['status'] = entry['status']
+                    row['progress'] = entry['progress']
+                    row['updated_at'] = entry['updated_at'] or row['updated_at']
+        return rows
+
+    def flush(self):
+        with self._lock:
+            rows = [
+                (self._entries[download_id]['status'], self._entries[download_id]['progress'],
+                 self._entries[download_id]['updated_at'], download_id)
+                for download_id in self._dirty if download_id in self._entries
+            ]
+            self._dirty.clear()
+
+        if not rows:
+            return 0
+
+        try:
+            # Never overwrite a terminal state written through by update()
+            self.db.executemany(
+                "UPDATE downloads SET status = ?, progress = ?, updated_at = ? "
+                f"WHERE id = ? AND status NOT IN ({','.join('?' * len(TERMINAL_STATES))})",
+                [row + TERMINAL_STATES for row in rows]
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Progress flush failed, will retry: {str(e)}")
+            with self._lock:
+                self._dirty.update(row[3] for row in rows if row[3] in self._entries)
+            return 0
+
+        return len(rows)
+
+    def sync(self):
+        """Replace the live rows with the running downloads recorded in the database."""
+        try:
+            rows = self.db.query(
+                f"SELECT id, user_id, status, progress, updated_at FROM downloads "
+                f"WHERE status IN ({','.join('?' * len(RUNNING_STATES))})",
+                RUNNING_STATES
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Progress sync failed, will retry: {str(e)}")
+            return
+
+        with self._lock:
+            changed = False
+            running = set()
+            for row in rows:
+                running.add(row['id'])
+                entry = self._entries.setdefault(row['id'], {'id': row['id']})
+                if any(entry.get(key) != value for key, value in row.items()):
+                    entry.update(row)
+                    changed = True
+
+            # Rows that left the running states have finished or gone back to the queue
+            for download_id in [download_id for download_id in self._entries if download_id not in running]:
+                del self._entries[download_id]
+                self._cached.discard(download_id)
+                changed = True
+
+            if changed:
+                self._notify()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            if self._mirror:
+                self.sync()
+            else:
+                self.flush()
@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+
+from progress import TERMINAL_STATES
+
+logger = logging.getLogger(__name__)
+
+# Columns of usage_daily added up when a download finishes
+USAGE_COLUMNS = ('finished', 'completed', 'failed', 'cancelled', 'bytes',
+                 'duration_total', 'duration_count', 'job_seconds')
+
+
+def _usage_values(row):
+    # SQL expressions for one finished download's contribution to usage_daily; row is NEW or OLD
+    completed = f"{row}.status = 'completed'"
+    return (
+        "1",
+        completed,
+        f"{row}.status = 'failed'",
+        f"{row}.status = 'cancelled'",
+        f"CASE WHEN {completed} THEN COALESCE({row}.file_size, 0) ELSE 0 END",
+        f"CASE WHEN {completed} THEN COALESCE({row}.duration, 0) ELSE 0 END",
+        f"{completed} AND {row}.duration IS NOT NULL",
+        f"CASE WHEN {completed} THEN MAX((julianday({row}.updated_at) - julianday({row}.created_at)) * 86400, 0) "
+        f"ELSE 0 END",
+    )
+
+
+def create_usage_schema(cursor):
+    """Create usage_daily and the triggers that keep it current, backfilling it from existing history.
+
+    The triggers count a download once it reaches a final state, whichever
+    process writes the status, and take it back out if that state changes
+    again. Deleting rows, as archiving does, leaves the totals untouched.
+    """
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usage_daily'").fetchone()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS usage_daily (
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        finished INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        cancelled INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        duration_total REAL NOT NULL DEFAULT 0,
+        duration_count INTEGER NOT NULL DEFAULT 0,
+        job_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, user_id)
+    )
+    ''')
+
+    finished = ','.join(f"'{state}'" for state in TERMINAL_STATES)
+    columns = ', '.join(USAGE_COLUMNS)
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS usage_daily_add AFTER UPDATE OF status ON downloads
+    WHEN NEW.status IN ({finished}) AND NEW.status IS NOT OLD.status
+    BEGIN
+        INSERT INTO usage_daily (day, user_id, {columns})
+        VALUES (date(NEW.created_at), NEW.user_id, {', '.join(_usage_values('NEW'))})
+        ON CONFLICT (day, user_id) DO UPDATE SET
+        {', '.join(f"{column} = {column} + excluded.{column}" for column in USAGE_COLUMNS)};
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS usage_daily_remove AFTER UPDATE OF status ON downloads
+    WHEN OLD.status IN ({finished}) AND NEW.status IS NOT OLD.status
+    BEGIN
+        UPDATE usage_daily SET
+        {', '.join(f"{column} = {column} - ({value})" for column, value in zip(USAGE_COLUMNS, _usage_values('OLD')))}
+        WHERE day = date(OLD.created_at) AND user_id = OLD.user_id;
+    END
+    ''')
+
+    if not exists:
+        for table in ('downloads', 'downloads_archive'):
+            cursor.execute(f'''
+            INSERT INTO usage_daily (day, user_id, {columns})
+            SELECT date(created_at), user_id, {', '.join(f"SUM({value})" for value in _usage_values(table))}
+            FROM {table} WHERE status IN ({finished})
+            GROUP BY date(created_at), user_id
+            ON CONFLICT (day, user_id) DO UPDATE SET
+            {', '.join(f"{column} = {column} + excluded.{column}" for column in USAGE_COLUMNS)}
+            ''')
+
+
+class RetentionManager:
+    """Keeps the downloads table small and the database tidy.
+
+    Every ``interval`` seconds, finished downloads created more than
+    ``retain_days`` days ago are moved to ``downloads_archive`` in
+    transactions of ``batch_size`` rows, so the write lock is only ever held
+    briefly. ``ANALYZE`` runs every ``analyze_interval`` seconds, and
+    ``VACUUM`` every ``vacuum_interval`` seconds once more than
+    ``vacuum_free_ratio`` of the file is free pages. The last run of each
+    task is recorded in the ``maintenance`` table, so several worker
+    processes sharing the database do not repeat it.
+    """
+
+    def __init__(self, db, retain_days=90, batch_size=1000, interval=3600,
+                 analyze_interval=86400, vacuum_interval=7 * 86400, vacuum_free_ratio=0.2):
+        self.db = db
+        self.retain_days = retain_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.analyze_interval = analyze_interval
+        self.vacuum_interval = vacuum_interval
+        self.vacuum_free_ratio = vacuum_free_ratio
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name="retention")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _columns(self, table):
+        return [row['name'] for row in self.db.query(f"PRAGMA table_info({table})")]
+
+    def archive(self):
+        """Move finished downloads past the retention age to the archive; return the number moved."""
+        if not self.retain_days:
+            return 0
+        archive_columns = set(self._columns('downloads_archive'))
+        columns = ', '.join(column for column in self._columns('downloads') if column in archive_columns)
+        finished = ','.join('?' * len(TERMINAL_STATES))
+
+        moved = 0
+        while True:
+            with self.db.transaction() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                ids = [row[0] for row in conn.execute(
+                    f"SELECT id FROM downloads WHERE status IN ({finished}) AND created_at < datetime('now', ?) "
+                    f"ORDER BY created_at LIMIT ?",
+                    (*TERMINAL_STATES, f"-{int(self.retain_days)} days", self.batch_size)
+                )]
+                if not ids:
+                    break
+                placeholders = ','.join('?' * len(ids))
+                conn.execute(
+                    f"INSERT OR REPLACE INTO downloads_archive ({columns}) "
+                    f"SELECT {columns} FROM downloads WHERE id IN ({placeholders})", ids
+                )
+                conn.execute(f"DELETE FROM downloads WHERE id IN ({placeholders})", ids)
+            moved += len(ids)
+            if len(ids) < self.batch_size:
+                break
+        if moved:
+            logger.info("Archived %d finished downloads older than %d days", moved, self.retain_days)
+        return moved
+
+    def _due(self, task, interval):
+        # Claim a maintenance task for this process if it has not run within interval seconds
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO maintenance (task, last_run) VALUES (?, 0)", (task,))
+            return conn.execute(
+                "UPDATE maintenance SET last_run = ? WHERE task = ? AND last_run < ?",
+                (now, task, now - interval)
+            ).rowcount == 1
+
+    def maintain(self):
+        """Run ANALYZE and VACUUM if they are due."""
+        if self._due('analyze', self.analyze_interval):
+            started = time.perf_counter()
+            self.db.execute("ANALYZE")
+            logger.info("ANALYZE finished in %.1fs", time.perf_counter() - started)
+
+        with self.db.connection() as conn:
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if pages and free / pages > self.vacuum_free_ratio and self._due('vacuum', self.vacuum_interval):
+            started = time.perf_counter()
+            with self.db.connection() as conn:
+                # VACUUM cannot run inside a transaction
+                conn.execute("VACUUM")
+            logger.info("VACUUM reclaimed %d of %d pages in %.1fs", free, pages, time.perf_counter() - started)
+
+    def _loop(self):
+        while True:
+            try:
+                self.archive()
+                self.maintain()
+            except Exception as e:
+                logger.error("Retention error: %s", e)
+            time.sleep(self.interval)
+
+
+def _summary(row):
+    # Derived figures for a row of summed usage_daily columns
+    finished = row['finished'] or 0
+    completed = row['completed'] or 0
+    failed = row['failed'] or 0
+    summary = {key: value for key, value in row.items() if key not in USAGE_COLUMNS}
+    summary.update({
+        'finished': finished,
+        'completed': completed,
+        'failed': failed,
+        'cancelled': row['cancelled'] or 0,
+        'bytes': row['bytes'] or 0,
+        # Cancelled downloads count neither way
+        'success_rate': round(completed / (completed + failed), 4) if completed + failed else None,
+        'avg_duration': round(row['duration_total'] / row['duration_count'], 1) if row['duration_count'] else None,
+        'avg_job_seconds': round(row['job_seconds'] / completed, 1) if completed else None,
+    })
+    return summary
+
+
+def usage_stats(db, start, end, user_id=None):
+    """Totals, per-day and per-user usage between two dates (inclusive), read from usage_daily only."""
+    where = "a.day BETWEEN ? AND ?"
+    params = [start, end]
+    if user_id is not None:
+        where += " AND a.user_id = ?"
+        params.append(user_id)
+    sums = ', '.join(f"SUM(a.{column}) AS {column}" for column in USAGE_COLUMNS)
+
+    totals = db.query(f"SELECT {sums} FROM usage_daily a WHERE {where}", params, one=True)
+    days = db.query(f"SELECT a.day, {sums} FROM usage_daily a WHERE {where} GROUP BY a.day ORDER BY a.day", params)
+    users = db.query(
+        f"SELECT a.user_id, u.username, {sums} FROM usage_daily a LEFT JOIN users u ON u.id = a.user_id "
+        f"WHERE {where} GROUP BY a.user_id ORDER BY finished DESC",
+        params
+    )
+    return {
+        'from': start,
+        'to': end,
+        'totals': _summary(totals),
+        'days': [_summary(row) for row in days],
+        'users': [_summary(row) for row in users],
+    }
@@ -0,0 +1,184 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RetryDownload(Exception):
+    """Raised by the runner to put the job back in the queue after ``delay`` seconds.
+
+    ``reason`` is recorded on the job as ``waiting_for``: 'retry' for a backoff
+    after a failed attempt, or a resource the job is waiting for.
+    """
+
+    def __init__(self, delay, reason='retry'):
+        super().__init__(f"Retry in {delay} seconds")
+        self.delay = delay
+        self.reason = reason
+
+
+class DownloadScheduler:
+    """Fixed-size worker pool that dispatches queued downloads fairly across users.
+
+    Every user has their own priority queue. When a worker frees up it picks the
+    user whose next job has the highest priority, breaking ties in favour of the
+    user that was served least recently, and never runs more than
+    ``per_user_limit`` jobs for the same user at once.
+    """
+
+    def __init__(self, runner, max_workers=4, per_user_limit=2):
+        self._runner = runner
+        self.max_workers = max_workers
+        self.per_user_limit = per_user_limit
+        self._cond = threading.Condition()
+        self._queues = {}       # user_id -> heap of (-priority, seq, job)
+        self._running = {}      # user_id -> number of running jobs
+        self._last_served = {}  # user_id -> dispatch tick of the last job started
+        self._delayed = []      # heap of (not_before, seq, job) waiting to be retried
+        self._seq = itertools.count()
+        self._tick = itertools.count(1)
+        self._workers = []
+        # download_id -> job dict, for every queued or running job
+        self.jobs = {}
+
+    def start(self):
+        if self._workers:
+            return
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"download-worker-{i}")
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Download scheduler started with {self.max_workers} workers "
+                    f"({self.per_user_limit} per user)")
+
+    def submit(self, download_id, user_id, url, target_path, priority=0, delay=0):
+        job = {
+            'id': download_id,
+            'user_id': user_id,
+            'url': url,
+            'target_path': target_path,
+            'priority': priority,
+            'state': 'queued',
+            'queued_at': time.time(),
+            'started_at': None,
+            'not_before': None,
+            'waiting_for': None,
+        }
+        with self._cond:
+            if download_id in self.jobs:
+                return self.jobs[download_id]
+            self.jobs[download_id] = job
+            self._enqueue(job, delay)
+            self._cond.notify()
+        return job
+
+    def _enqueue(self, job, delay=0):
+        # Caller must hold self._cond
+        if delay > 0:
+            job['not_before'] = time.time() + delay
+            heapq.heappush(self._delayed, (job['not_before'], next(self._seq), job))
+        else:
+            job['not_before'] = None
+            job['waiting_for'] = None
+            heapq.heappush(self._queues.setdefault(job['user_id'], []), (-job['priority'], next(self._seq), job))
+
+    def cancel(self, download_id):
+        """Drop a queued job; return the state it was in, or None if the job is unknown."""
+        with self._cond:
+            job = self.jobs.get(download_id)
+            if job is None:
+                return None
+            if job['state'] == 'queued':
+                # Left in its heap and skipped when it reaches the top
+                job['state'] = 'cancelled'
+                del self.jobs[download_id]
+                return 'queued'
+            return job['state']
+
+    def snapshot(self):
+        with self._cond:
+            jobs = [dict(job) for job in self.jobs.values()]
+        jobs.sort(key=lambda job: (job['state'] != 'running', -job['priority'], job['queued_at']))
+        return {
+            'max_workers': self.max_workers,
+            'per_user_limit': self.per_user_limit,
+            'running': sum(1 for job in jobs if job['state'] == 'running'),
+            'queued': sum(1 for job in jobs if job['state'] == 'queued'),
+            'jobs': jobs,
+        }
+
+    def _next_job(self):
+        # Caller must hold self._cond
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            job = heapq.heappop(self._delayed)[2]
+            if job['state'] != 'cancelled':
+                self._enqueue(job)
+
+        for user_id in list(self._queues):
+            queue = self._queues[user_id]
+            while queue and queue[0][2]['state'] == 'cancelled':
+                heapq.heappop(queue)
+            if not queue:
+                del self._queues[user_id]
+
+        best_user = None
+        best_key = None
+        for user_id, queue in self._queues.items():
+            if not queue or self._running.get(user_id, 0) >= self.per_user_limit:
+                continue
+            key = (queue[0][0], self._last_served.get(user_id, 0), queue[0][1])
+            if best_key is None or key < best_key:
+                best_user, best_key = user_id, key
+
+        if best_user is None:
+            return None
+
+        queue = self._queues[best_user]
+        job = heapq.heappop(queue)[2]
+        if not queue:
+            del self._queues[best_user]
+        self._running[best_user] = self._running.get(best_user, 0) + 1
+        self._last_served[best_user] = next(self._tick)
+        job['state'] = 'running'
+        job['started_at'] = time.time()
+        return job
+
+    def _next_wakeup(self):
+        # Caller must hold self._cond; seconds until the next delayed job is due
+        if not self._delayed:
+            return None
+        return max(self._delayed[0][0] - time.time(), 0)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait(self._next_wakeup())
+                    job = self._next_job()
+
+            retry = None
+            try:
+                self._runner(job['id'], job['url'], job['target_path'])
+            except RetryDownload as e:
+                retry = e
+            except Exception as e:
+                logger.error(f"Unhandled error in download worker for {job['id']}: {str(e)}")
+            finally:
+                with self._cond:
+                    user_id = job['user_id']
+                    self._running[user_id] -= 1
+                    if not self._running[user_id]:
+                        del self._running[user_id]
+                    if retry is not None and job['state'] != 'cancelled':
+                        job['state'] = 'queued'
+                        job['waiting_for'] = retry.reason
+                        self._enqueue(job, retry.delay)
+                    else:
+                        self.jobs.pop(job['id'], None)
+                    self._cond.notify_all()
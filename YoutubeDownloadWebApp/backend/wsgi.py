@@ -0,0 +1,8 @@
+# Entry point for the web tier under a multi-process WSGI server, e.g.
+#   gunicorn -k gthread -w 4 --threads 32 -b 0.0.0.0:4000 wsgi:app
+# with downloads run by one or more `python app.py worker` processes.
+# gunicorn.conf.py holds these settings. Each open progress stream holds a
+# thread, so use threaded or async workers; sync workers time out on streams.
+from app import app, start_services
+
+start_services('web')
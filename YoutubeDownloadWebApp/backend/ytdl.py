@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Options YoutubeDL only reads while it is being built, so they cannot differ between
+# the jobs sharing a client
+BUILD_OPTIONS = ('outtmpl', 'progress_hooks', 'postprocessor_hooks', 'post_hooks', 'postprocessors',
+                 'http_headers', 'cookiefile', 'cookiesfrombrowser', 'download_archive', 'logger',
+                 'compat_opts', 'proxy', 'impersonate', 'js_runtimes', 'remote_components')
+
+# Format selectors kept per client; specs naming format IDs differ from video to video
+FORMAT_SELECTOR_CACHE = 32
+
+_client_class = None
+_client_class_lock = threading.Lock()
+
+
+def client_class():
+    """The YoutubeDL subclass the pool builds, defined on first use so yt-dlp is imported only when needed."""
+    global _client_class
+    with _client_class_lock:
+        if _client_class is not None:
+            return _client_class
+
+        started = time.perf_counter()
+        import yt_dlp
+        logger.info("Loaded yt-dlp %s in %.2fs", yt_dlp.version.__version__, time.perf_counter() - started)
+
+        class PooledYoutubeDL(yt_dlp.YoutubeDL):
+            """yt-dlp client whose hooks and format are swapped per job.
+
+            It also stops once the streams are downloaded: post-processing,
+            which includes the ffmpeg merge of separate video and audio, is
+            kept for ``run_post_process``.
+            """
+
+            deferred_post_process = None
+
+            def __init__(self, params):
+                super().__init__(params)
+                self.base_params = dict(self.params)
+                self.base_format_selector = self.format_selector
+                self.format_selectors = {params.get('format'): self.format_selector}
+                self.job_progress_hooks = ()
+                self.job_postprocessor_hooks = ()
+                self.add_progress_hook(self._job_progress_hook)
+                self.add_postprocessor_hook(self._job_postprocessor_hook)
+
+            def _job_progress_hook(self, d):
+                for hook in self.job_progress_hooks:
+                    hook(d)
+
+            def _job_postprocessor_hook(self, d):
+                for hook in self.job_postprocessor_hooks:
+                    hook(d)
+
+            def post_process(self, filename, info, files_to_move=None):
+                info['filepath'] = filename
+                self.deferred_post_process = (filename, info, files_to_move)
+                return info
+
+            def run_post_process(self):
+                filename, info, files_to_move = self.deferred_post_process
+                return super().post_process(filename, info, files_to_move)
+
+        _client_class = PooledYoutubeDL
+        return _client_class
+
+
+class YoutubeDLPool:
+    """Built yt-dlp clients reused from job to job.
+
+    Building a YoutubeDL registers every extractor and parses the format
+    spec, and its extractors keep what they fetch (player code, tokens,
+    open connections) for as long as the client lives, so building one per
+    job slows the start of every download. The pool builds clients with
+    ``params`` and keeps up to ``size`` idle ones; ``start`` builds them
+    in the background so the first jobs find them ready.
+
+    A job takes a client with ``acquire``, passing its hooks, its format and
+    any options yt-dlp reads while it downloads, such as ``paths`` or
+    ``extract_flat``, and gives it back with ``release``, which restores the
+    pool's options. ``BUILD_OPTIONS`` cannot be set per job.
+    """
+
+    def __init__(self, params, size, warm_extractors=('Youtube', 'Generic')):
+        self.params = params
+        self.size = size
+        self.warm_extractors = warm_extractors
+        self._lock = threading.Lock()
+        self._idle = []
+        self.built = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._warm, name="ytdl-pool")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _build(self):
+        started = time.perf_counter()
+        client = client_class()(dict(self.params))
+        for key in self.warm_extractors:
+            client.get_info_extractor(key)
+        with self._lock:
+            self.built += 1
+        logger.debug("Built yt-dlp client in %.3fs", time.perf_counter() - started)
+        return client
+
+    def _warm(self):
+        try:
+            for _ in range(self.size - self.built):
+                client = self._build()
+                with self._lock:
+                    self._idle.append(client)
+        except Exception as e:
+            logger.error("Could not build yt-dlp clients: %s", e)
+
+    def acquire(self, format=None, progress_hooks=(), postprocessor_hooks=(), **params):
+        """Take a client set up for one job, building one if none is idle."""
+        fixed = [key for key in params if key in BUILD_OPTIONS]
+        if fixed:
+            raise ValueError(f"Options {', '.join(fixed)} are fixed when the yt-dlp client is built")
+
+        with self._lock:
+            client = self._idle.pop() if self._idle else None
+        if client is None:
+            client = self._build()
+
+        client.params.update(params)
+        if format is not None:
+            client.params['format'] = format
+            if format not in client.format_selectors:
+                if len(client.format_selectors) >= FORMAT_SELECTOR_CACHE:
+                    client.format_selectors = {client.base_params.get('format'): client.base_format_selector}
+                client.format_selectors[format] = client.build_format_selector(format)
+            client.format_selector = client.format_selectors[format]
+        client.job_progress_hooks = tuple(progress_hooks)
+        client.job_postprocessor_hooks = tuple(postprocessor_hooks)
+        return client
+
+    def release(self, client):
+        """Put a client back with the pool's options, or close it if enough are idle."""
+        client.params = dict(client.base_params)
+        client.format_selector = client.base_format_selector
+        client.job_progress_hooks = ()
+        client.job_postprocessor_hooks = ()
+        client.deferred_post_process = None
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(client)
+                return
+        client.close()
+
+    @contextmanager
+    def client(self, **options):
+        client = self.acquire(**options)
+        try:
+            yield client
+        finally:
+            self.release(client)
@@ -1,5 +1,5 @@
 // /scripts/downloaderapp/frontend/src/pages/Dashboard.js
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Link } from 'react-router-dom';
 import { 
   Container, Box, Typography, TextField, Button, Paper, Grid, 
@@ -15,7 +15,7 @@ import {
   CloudDownload as CloudDownloadIcon, Cancel as CancelIcon
 } from '@mui/icons-material';
 import { motion } from 'framer-motion';
-import { startDownloads, getDownloadStatus, cancelDownload } from '../services/api';
+import { startDownloads, getDownloadStatuses, openDownloadStream, cancelDownload } from '../services/api';
 
 const Dashboard = ({ isAdmin, onLogout }) => {
   const [anchorEl, setAnchorEl] = useState(null);
@@ -32,41 +32,77 @@ const Dashboard = ({ isAdmin, onLogout }) => {
   const user = localStorage.getItem('authToken') ? 
     JSON.parse(atob(localStorage.getItem('authToken').split('.')[1])) : null;
 
+  const activeDownloadsRef = useRef(activeDownloads);
+  activeDownloadsRef.current = activeDownloads;
+
+  const isFinished = (status) => status === 'completed' || status === 'failed' || status === 'cancelled';
+  const hasPendingDownloads = activeDownloads.some(download => !isFinished(download.status));
+  const pendingIdsKey = activeDownloads
+    .filter(download => !isFinished(download.status))
+    .map(download => download.id)
+    .slice(0, 100)
+    .join(',');
+
   useEffect(() => {
-    // Poll for active downloads status
-    if (activeDownloads.length > 0) {
-      const interval = setInterval(() => {
-        updateDownloadStatus();
-      }, 2000);
-      
-      return () => clearInterval(interval);
+    // Stream status updates for active downloads, falling back to batch polling
+    if (!pendingIdsKey) {
+      return undefined;
     }
-  }, [activeDownloads]);
 
-  const updateDownloadStatus = async () => {
-    try {
-      const updatedDownloads = [...activeDownloads];
-      let allCompleted = true;
-      
-      for (let i = 0; i < updatedDownloads.length; i++) {
-        const download = updatedDownloads[i];
-        if (download.status !== 'completed' && download.status !== 'failed' && download.status !== 'cancelled') {
-          const response = await getDownloadStatus(download.id);
-          updatedDownloads[i] = { ...download, ...response.data };
-          
-          if (response.data.status !== 'completed' && response.data.status !== 'failed' && response.data.status !== 'cancelled') {
-            allCompleted = false;
-          }
-        }
+    let interval = null;
+    // The stream starts with the current state of these, so none that finished before it opened are
+    // missed; it is reopened whenever the pending downloads change, so new ones are watched too
+    const stream = openDownloadStream(pendingIdsKey.split(','));
+    stream.addEventListener('progress', (event) => {
+      applyDownloadUpdates(JSON.parse(event.data));
+    });
+    stream.onerror = () => {
+      stream.close();
+      if (!interval) {
+        interval = setInterval(() => {
+          updateDownloadStatus();
+        }, 2000);
       }
-      
-      setActiveDownloads(updatedDownloads);
-      
-      if (allCompleted && updatedDownloads.length > 0) {
-        setIsDownloading(false);
-        setSuccessMessage('All downloads completed!');
-        setTimeout(() => setSuccessMessage(''), 5000);
+    };
+
+    return () => {
+      stream.close();
+      if (interval) {
+        clearInterval(interval);
       }
+    };
+  }, [pendingIdsKey]);
+
+  useEffect(() => {
+    if (!hasPendingDownloads && activeDownloads.length > 0) {
+      setIsDownloading(false);
+      setSuccessMessage('All downloads completed!');
+      setTimeout(() => setSuccessMessage(''), 5000);
+    }
+  }, [hasPendingDownloads]);
+
+  const applyDownloadUpdates = (updates) => {
+    const updatesById = {};
+    updates.forEach(update => {
+      updatesById[update.id] = update;
+    });
+    setActiveDownloads(prev => prev.map(download => (
+      updatesById[download.id] ? { ...download, ...updatesById[download.id] } : download
+    )));
+  };
+
+  const updateDownloadStatus = async () => {
+    const pendingIds = activeDownloadsRef.current
+      .filter(download => !isFinished(download.status))
+      .map(download => download.id)
+      .slice(0, 100);
+    if (pendingIds.length === 0) {
+      return;
+    }
+
+    try {
+      const response = await getDownloadStatuses(pendingIds);
+      applyDownloadUpdates(response.data);
     } catch (error) {
       console.error('Error updating download status:', error);
     }
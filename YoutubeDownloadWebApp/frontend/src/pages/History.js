@@ -12,11 +12,14 @@ import {
   CloudDownload as CloudDownloadIcon
 } from '@mui/icons-material';
 import { motion } from 'framer-motion';
-import { getDownloads, getAllDownloads } from '../services/api';
+import { getDownloads, getAllDownloads, getDownloadsSummary, getAllDownloadsSummary } from '../services/api';
 
 const History = ({ isAdmin, onLogout }) => {
   const [anchorEl, setAnchorEl] = useState(null);
   const [downloads, setDownloads] = useState([]);
+  const [totalCount, setTotalCount] = useState(0);
+  // cursors[n] is the cursor that loads page n; page 0 starts at the newest download
+  const [cursors, setCursors] = useState([null]);
   const [loading, setLoading] = useState(true);
   const [page, setPage] = useState(0);
   const [rowsPerPage, setRowsPerPage] = useState(10);
@@ -26,14 +29,35 @@ const History = ({ isAdmin, onLogout }) => {
     JSON.parse(atob(localStorage.getItem('authToken').split('.')[1])) : null;
 
   useEffect(() => {
-    fetchDownloads();
+    fetchSummary();
+    setCursors([null]);
+    setPage(0);
+    fetchDownloads(0, rowsPerPage, [null]);
   }, [isAdmin]);
 
-  const fetchDownloads = async () => {
+  const fetchSummary = async () => {
+    try {
+      const response = isAdmin ? await getAllDownloadsSummary() : await getDownloadsSummary();
+      setTotalCount(response.data.total);
+    } catch (error) {
+      console.error('Error fetching download summary:', error);
+    }
+  };
+
+  const fetchDownloads = async (pageIndex, limit, pageCursors) => {
     try {
       setLoading(true);
-      const response = isAdmin ? await getAllDownloads() : await getDownloads();
-      setDownloads(response.data);
+      const params = { limit };
+      if (pageCursors[pageIndex]) {
+        params.cursor = pageCursors[pageIndex];
+      }
+      const response = isAdmin ? await getAllDownloads(params) : await getDownloads(params);
+      setDownloads(response.data.downloads);
+      const nextCursors = pageCursors.slice(0, pageIndex + 1);
+      if (response.data.next_cursor) {
+        nextCursors.push(response.data.next_cursor);
+      }
+      setCursors(nextCursors);
       setError('');
     } catch (error) {
       console.error('Error fetching downloads:', error);
@@ -52,12 +76,18 @@ const History = ({ isAdmin, onLogout }) => {
   };
 
   const handleChangePage = (event, newPage) => {
+    if (newPage >= cursors.length) {
+      return;
+    }
     setPage(newPage);
+    fetchDownloads(newPage, rowsPerPage, cursors);
   };
 
   const handleChangeRowsPerPage = (event) => {
-    setRowsPerPage(parseInt(event.target.value, 10));
+    const newRowsPerPage = parseInt(event.target.value, 10);
+    setRowsPerPage(newRowsPerPage);
     setPage(0);
+    fetchDownloads(0, newRowsPerPage, [null]);
   };
 
   const getStatusColor = (status) => {
@@ -202,7 +232,6 @@ const History = ({ isAdmin, onLogout }) => {
                       </TableHead>
                       <TableBody>
                         {downloads
-                          .slice(page * rowsPerPage, page * rowsPerPage + rowsPerPage)
                           .map((download) => (
                             <TableRow key={download.id} sx={{ '&:hover': { bgcolor: '#222' } }}>
                               {isAdmin && <TableCell>{download.username}</TableCell>}
@@ -253,7 +282,7 @@ const History = ({ isAdmin, onLogout }) => {
                   <TablePagination
                     rowsPerPageOptions={[5, 10, 25, 50]}
                     component="div"
-                    count={downloads.length}
+                    count={totalCount}
                     rowsPerPage={rowsPerPage}
                     page={page}
                     onPageChange={handleChangePage}
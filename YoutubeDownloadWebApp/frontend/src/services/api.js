@@ -58,18 +58,38 @@ export const startDownloads = (urls, targetPaths) => {
   return api.post('/downloads', { urls, targetPaths });
 };
 
-export const getDownloads = () => {
-  return api.get('/downloads');
+// History is paginated: pass { limit, cursor, status, from, to } and
+// follow next_cursor from the previous page
+export const getDownloads = (params = {}) => {
+  return api.get('/downloads', { params });
 };
 
-export const getAllDownloads = () => {
-  return api.get('/downloads/all');
+export const getAllDownloads = (params = {}) => {
+  return api.get('/downloads/all', { params });
+};
+
+export const getDownloadsSummary = (params = {}) => {
+  return api.get('/downloads/summary', { params });
+};
+
+export const getAllDownloadsSummary = (params = {}) => {
+  return api.get('/downloads/all/summary', { params });
 };
 
 export const getDownloadStatus = (downloadId) => {
   return api.get(`/downloads/${downloadId}`);
 };
 
+export const getDownloadStatuses = (downloadIds) => {
+  return api.get('/downloads/status', { params: { ids: downloadIds.join(',') } });
+};
+
+// EventSource cannot send headers, so the token goes in the query string
+export const openDownloadStream = (ids = []) => {
+  const token = localStorage.getItem('authToken');
+  return new EventSource(`${API_URL}/downloads/stream?token=${encodeURIComponent(token)}&ids=${ids.join(',')}`);
+};
+
 export const cancelDownload = (downloadId) => {
   return api.post(`/downloads/${downloadId}/cancel`);
 };